@@ -0,0 +1,539 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import sys
+import os
+import json
+import time
+import random
+import argparse
+import importlib.util
+import resource
+import tempfile
+import shutil
+import statistics
+import subprocess
+import threading
+import collections
+import functools
+import multiprocessing
+import urllib.parse
+import urllib.request
+import http.server
+from datetime import datetime, timedelta, timezone
+
+# The script to benchmark
+SCRIPT_FILEPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fm4-7tage-download.py')
+
+# Stand-in for ORF's servers
+MOCK_SETTINGS = {
+    'broadcasts': 3,            # number of broadcasts in search results
+    'duration': 3*3600,         # duration of each broadcast in seconds
+    'chapter_duration': 180,    # seconds per chapter (item)
+    'images': 20,               # number of different images used by chapters
+    'image_size': 30*1024,      # bytes per image
+    'throttle': None,           # bytes per second and connection for audio, None: unlimited
+    'fail_rate': 0.0,           # share of requests that fail (audio: connection drops mid-transfer, else HTTP 503)
+    'seed': 0,
+}
+
+# Functions of the script whose calls get timed, in pipeline order
+STAGES = [
+    'get_search_results',
+    'get_broadcast',
+    'download_broadcast',
+    'cut_audio',
+    'align_chapters_to_keepmarks',
+    'set_id3_tags',
+    'finish_broadcast',
+]
+
+# Modules a run with nothing to do should not need to import
+HEAVY_MODULES = [ 'mutagen', 'cProfile', 'tomllib' ]
+
+# Runs the script's main() against the mock server in a fresh interpreter: script path, mock server URL, script arguments
+STARTUP_BOOTSTRAP = '''
+import sys, importlib.util
+spec = importlib.util.spec_from_file_location('fm4_7tage_download', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = module
+spec.loader.exec_module(module)
+module.STATION_INFO['player_search_url'] = sys.argv[2] + '/search?q={query}&limit={limit}&offset={offset}'
+sys.argv = [ sys.argv[1] ] + sys.argv[3:]
+module.main()
+'''
+
+# One MPEG-1 Layer III frame: 128 kBit/s, 44.1 kHz, joint stereo, silence
+MP3_FRAME = b'\xff\xfb\x90\x44' + bytes(413)
+MP3_FRAME_DURATION = 1152 / 44100
+
+
+def make_broadcasts(base_url, settings):
+    """
+    Create search results and broadcast JSON like ORF's API returns them
+    Each broadcast has a chapter every 'chapter_duration' seconds, news get left out every hour.
+    Return tuple (list of search hits, dict of broadcast JSON by id)
+    """
+
+    hits = []
+    broadcasts = {}
+    duration = settings['duration'] * 1000
+    end = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+
+    for num in range(settings['broadcasts']):
+        broadcast_id = 1000 + num
+        start = end - timedelta(milliseconds=duration)
+        href = f'{base_url}/broadcast/{broadcast_id}'
+
+        items = []
+        streams = []
+        stream_start = 0
+        for item_num, offset in enumerate(range(0, duration, settings['chapter_duration'] * 1000)):
+            item_type = 'N' if offset % 3600000 == 0 else ('W' if item_num % 7 == 3 else ('J' if item_num % 5 == 4 else 'M'))
+            image_num = item_num % settings['images']
+            items.append({
+                'entity': 'BroadcastItem',
+                'start': (start + timedelta(milliseconds=offset)).isoformat(),
+                'duration': min(settings['chapter_duration'] * 1000, duration - offset),
+                'type': item_type,
+                'title': f'Song <b>{item_num}</b>',
+                'interpreter': f'Artist {item_num % 13}',
+                'description': f'<p>Description of item {item_num}</p><p>with two paragraphs</p>',
+                'images': [{
+                    'alt': f'Image {image_num}',
+                    'versions': [ { 'path': f'{base_url}/image/{image_num}/{width}.jpg', 'width': width } for width in (600, 300, 100) ],
+                }],
+            })
+            if item_type == 'N':
+                # ORF's player leaves out the news
+                if offset > stream_start:
+                    streams.append([stream_start, offset])
+                stream_start = offset + settings['chapter_duration'] * 1000
+        if stream_start < duration:
+            streams.append([stream_start, duration])
+
+        search_result = {
+            'id': broadcast_id,
+            'href': href,
+            'title': 'Benchmark Show',
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+        }
+        broadcasts[broadcast_id] = {
+            **search_result,
+            'duration': duration,
+            'subtitle': '<p>Benchmark broadcast</p>',
+            'description': '<p>' + 'Lorem ipsum dolor sit amet. ' * 50 + '</p>',
+            'pressRelease': '<p>' + 'Press release. ' * 100 + '</p>',
+            'link': { 'url': f'{base_url}/show' },
+            'orfcategories': [ { 'categories': ['Musik'] } ],
+            'images': [{
+                'alt': 'Cover',
+                'versions': [ { 'path': f'{base_url}/image/cover/{width}.jpg', 'width': width } for width in (1400, 600) ],
+            }],
+            'items': items,
+            'streams': [{
+                'offsetStart': stream_start,
+                'offsetEnd': stream_end,
+                'uriTemplates': { 'progressive': f'{base_url}/audio/{broadcast_id}.mp3' + '{&offset,offsetende}' },
+            } for stream_start, stream_end in streams ],
+        }
+        hits.append({ 'data': search_result })
+        end = start - timedelta(hours=1)
+
+    return hits, broadcasts
+
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serve search results, broadcast JSON, images and MP3 audio (with Range requests), and request statistics on /stats
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def count(self, kind, num_bytes=0):
+        with self.server.lock:
+            self.server.stats['requests'][kind] += 1
+            self.server.stats['bytes'][kind] += num_bytes
+
+    def fail(self, kind):
+        # Inject a failure? Counted as '<kind>_failed'
+        if self.server.random.random() < self.server.settings['fail_rate']:
+            self.count(kind + '_failed')
+            return True
+        return False
+
+    def send_body(self, body, content_type, status=200, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data):
+        self.send_body(json.dumps(data).encode(), 'application/json')
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        path = url.path.strip('/').split('/')
+
+        if path[0] == 'stats':
+            with self.server.lock:
+                self.send_json(self.server.stats)
+            return
+
+        kind = path[0]
+        if kind not in ('search', 'broadcast', 'image', 'audio'):
+            self.count('not_found')
+            self.send_body(b'', 'text/plain', status=404)
+            return
+
+        if kind != 'audio' and self.fail(kind):
+            self.send_body(b'', 'text/plain', status=503)
+            return
+
+        if kind == 'search':
+            query = urllib.parse.parse_qs(url.query)
+            limit = int(query['limit'][0])
+            offset = int(query['offset'][0])
+            payload = self.server.hits[offset:offset+limit]
+            self.count(kind)
+            self.send_json({ 'payload': payload, 'length': len(payload), 'total': len(self.server.hits) })
+
+        elif kind == 'broadcast':
+            self.count(kind)
+            self.send_json({ 'payload': self.server.broadcasts[int(path[1])] })
+
+        elif kind == 'image':
+            image = self.server.images[path[1]]
+            self.count(kind, len(image))
+            self.send_body(image, 'image/jpeg', headers={ 'ETag': f'"{path[1]}"' })
+
+        else:
+            self.send_audio()
+
+    def send_audio(self):
+        audio = self.server.audio
+        size = len(audio)
+        start = 0
+        end = size - 1
+        status = 200
+
+        byte_range = self.headers.get('Range')
+        if byte_range and (self.headers.get('If-Range') in (None, '"audio"')):
+            first, last = byte_range.split('=', 1)[1].split('-', 1)
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if start >= size:
+                self.count('audio')
+                self.send_body(b'', 'audio/mpeg', status=416, headers={ 'Content-Range': f'bytes */{size}' })
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'audio/mpeg')
+        self.send_header('Content-Length', str(end + 1 - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"audio"')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+
+        # Drop connection somewhere in the middle?
+        stop = end + 1
+        if self.fail('audio'):
+            stop = self.server.random.randint(start, end)
+
+        chunk_size = 64*1024
+        throttle = self.server.settings['throttle']
+        began = time.monotonic()
+        sent = 0
+        try:
+            for offset in range(start, stop, chunk_size):
+                chunk = audio[offset:min(offset + chunk_size, stop)]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if throttle:
+                    delay = began + sent / throttle - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+        except OSError:
+            pass
+        self.count('audio', sent)
+        if stop <= end:
+            self.close_connection = True
+
+
+class MockServer(http.server.ThreadingHTTPServer):
+    """
+    Mock server that does not complain about clients closing connections, downloads do that when they retry
+    """
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(settings, port_queue):
+    """
+    Run mock server until the process gets terminated
+    Puts the server's port into port_queue once it's ready
+    """
+
+    server = MockServer(('127.0.0.1', 0), MockHandler)
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    rng = random.Random(settings['seed'])
+    server.settings = settings
+    server.random = rng
+    server.lock = threading.Lock()
+    server.stats = { 'requests': collections.Counter(), 'bytes': collections.Counter() }
+    server.hits, server.broadcasts = make_broadcasts(base_url, settings)
+    server.audio = MP3_FRAME * round(settings['duration'] / MP3_FRAME_DURATION)
+    server.images = { str(num): b'\xff\xd8\xff\xe0' + rng.randbytes(settings['image_size']) for num in range(settings['images']) }
+    server.images['cover'] = b'\xff\xd8\xff\xe0' + rng.randbytes(settings['image_size'] * 4)
+
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def start_mock_server(settings):
+    """
+    Start mock server in a separate process, so its memory does not count for the benchmark
+    Return tuple (process, base URL)
+    """
+
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(settings, port_queue), daemon=True)
+    process.start()
+    return process, f'http://127.0.0.1:{port_queue.get(timeout=60)}'
+
+
+def get_peak_rss():
+    """
+    Return peak resident set size of this process in bytes
+    """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kByte, macOS Byte
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def load_script():
+    """
+    Import fm4-7tage-download.py as module
+    It's registered in sys.modules, so worker processes can find its functions
+    """
+
+    spec = importlib.util.spec_from_file_location('fm4_7tage_download', SCRIPT_FILEPATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def time_stages(module, stage_stats):
+    """
+    Replace the module's stage functions with wrappers recording their calls in stage_stats
+    Calls of the module's functions look up module globals, so the wrappers see calls from within the script, too.
+    """
+
+    lock = threading.Lock()
+
+    def timed(name, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            rss_before = get_peak_rss()
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                with lock:
+                    stats = stage_stats[name]
+                    stats['calls'] += 1
+                    stats['seconds'] += seconds
+                    stats['max_seconds'] = max(stats['max_seconds'], seconds)
+                    stats['peak_rss_growth'] += get_peak_rss() - rss_before
+        return wrapper
+
+    for name in STAGES:
+        stage_stats[name] = { 'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'peak_rss_growth': 0 }
+        setattr(module, name, timed(name, getattr(module, name)))
+
+
+def run_benchmark(script_args, settings):
+    """
+    Run the script's whole main() pipeline against the mock server
+    Return dict with results
+    """
+
+    process, base_url = start_mock_server(settings)
+    workdir = tempfile.mkdtemp(prefix='fm4-benchmark-')
+    try:
+        module = load_script()
+        module.STATION_INFO['player_search_url'] = base_url + '/search?q={query}&limit={limit}&offset={offset}'
+
+        stage_stats = {}
+        time_stages(module, stage_stats)
+
+        target_directory = os.path.join(workdir, 'target')
+        os.mkdir(target_directory)
+        sys.argv = [ SCRIPT_FILEPATH, '--cache-dir', os.path.join(workdir, 'cache') ] + script_args + [ 'Benchmark Show', target_directory ]
+
+        rss_before = get_peak_rss()
+        start = time.perf_counter()
+        module.main()
+        wall_time = time.perf_counter() - start
+
+        with urllib.request.urlopen(base_url + '/stats') as response:
+            server_stats = json.load(response)
+
+        output_files = [ os.path.join(target_directory, f) for f in os.listdir(target_directory) if f.endswith('.mp3') ]
+        output_bytes = sum(os.path.getsize(f) for f in output_files)
+        audio_bytes = server_stats['bytes'].get('audio', 0)
+
+        return {
+            'script_args': script_args,
+            'settings': settings,
+            'wall_seconds': wall_time,
+            'files': len(output_files),
+            'output_bytes': output_bytes,
+            'audio_bytes_downloaded': audio_bytes,
+            'download_mbyte_per_second': audio_bytes / wall_time / (1024*1024),
+            'output_mbyte_per_second': output_bytes / wall_time / (1024*1024),
+            'peak_rss_bytes': get_peak_rss(),
+            'peak_rss_growth_bytes': get_peak_rss() - rss_before,
+            'requests': server_stats['requests'],
+            'stages': stage_stats,
+        }
+    finally:
+        process.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_startup_benchmark(script_args, settings, runs):
+    """
+    Measure startup of the script in fresh interpreters: showing its help, and a run with nothing to do
+    (all broadcasts already downloaded), which is what most cron runs are
+    Return dict with results
+    """
+
+    process, base_url = start_mock_server(settings)
+    workdir = tempfile.mkdtemp(prefix='fm4-benchmark-')
+    try:
+        target_directory = os.path.join(workdir, 'target')
+        os.mkdir(target_directory)
+        run_args = [ sys.executable, '-c', STARTUP_BOOTSTRAP, SCRIPT_FILEPATH, base_url, '--cache-dir', os.path.join(workdir, 'cache') ] + script_args + [ 'Benchmark Show', target_directory ]
+
+        # Download everything once
+        subprocess.run(run_args, check=True, stdout=subprocess.DEVNULL)
+
+        def measure(command):
+            start = time.perf_counter()
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            return time.perf_counter() - start
+
+        help_seconds = [ measure([ sys.executable, SCRIPT_FILEPATH, '--help' ]) for run in range(runs) ]
+        noop_seconds = [ measure(run_args) for run in range(runs) ]
+
+        # Which modules does a run with nothing to do import, and how long does importing take?
+        importtime = subprocess.run([ sys.executable, '-X', 'importtime' ] + run_args[1:], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True).stderr
+        imports = {}
+        for line in importtime.splitlines():
+            if line.startswith('import time:') and not line.endswith('imported package'):
+                self_time, cumulative, module = [ field.strip() for field in line[len('import time:'):].split('|') ]
+                if self_time.isdigit():
+                    imports[module] = int(self_time)
+
+        return {
+            'script_args': script_args,
+            'runs': runs,
+            'help_seconds': { 'median': statistics.median(help_seconds), 'min': min(help_seconds) },
+            'noop_seconds': { 'median': statistics.median(noop_seconds), 'min': min(noop_seconds) },
+            'noop_import_seconds': sum(imports.values()) / 1e6,
+            'noop_heavy_modules': [ module for module in HEAVY_MODULES if module in imports ],
+        }
+    finally:
+        process.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_startup_report(results):
+    """
+    Print startup benchmark results
+    """
+
+    print(f"Arguments:        {' '.join(results['script_args']) or '-'}")
+    print(f"Runs:             {results['runs']}")
+    print(f"--help:           {results['help_seconds']['median']*1000:.0f} ms (median), {results['help_seconds']['min']*1000:.0f} ms (min)")
+    print(f"Nothing to do:    {results['noop_seconds']['median']*1000:.0f} ms (median), {results['noop_seconds']['min']*1000:.0f} ms (min)")
+    print(f"Imports:          {results['noop_import_seconds']*1000:.0f} ms")
+    print(f"Heavy modules:    {', '.join(results['noop_heavy_modules']) or 'none'} loaded (of {', '.join(HEAVY_MODULES)})")
+
+
+def print_report(results):
+    """
+    Print benchmark results as table
+    """
+
+    mbyte = 1024*1024
+    print(f"Arguments:        {' '.join(results['script_args']) or '-'}")
+    print(f"Wall time:        {results['wall_seconds']:.2f} s")
+    print(f"Files:            {results['files']} ({results['output_bytes']/mbyte:.1f} MByte)")
+    print(f"Downloaded audio: {results['audio_bytes_downloaded']/mbyte:.1f} MByte ({results['download_mbyte_per_second']:.1f} MByte/s)")
+    print(f"Output:           {results['output_mbyte_per_second']:.1f} MByte/s")
+    print(f"Peak RSS:         {results['peak_rss_bytes']/mbyte:.1f} MByte (+{results['peak_rss_growth_bytes']/mbyte:.1f} MByte during run)")
+    print(f"Requests:         {', '.join(f'{kind}={count}' for kind, count in sorted(results['requests'].items()))}")
+    print()
+    print(f"{'Stage':<30} {'Calls':>6} {'Total s':>9} {'Max s':>8} {'Peak RSS +MB':>13}")
+    for name in STAGES:
+        stats = results['stages'][name]
+        print(f"{name:<30} {stats['calls']:>6} {stats['seconds']:>9.3f} {stats['max_seconds']:>8.3f} {stats['peak_rss_growth']/mbyte:>13.1f}")
+    print("(Stages run in parallel with --jobs > 1, and include the stages they call)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = "Benchmark fm4-7tage-download.py's whole pipeline against a local stand-in for ORF's servers, with synthetic broadcasts, MP3 files and images.",
+        epilog = "All arguments after -- are passed to fm4-7tage-download.py, e.g. -- --jobs 3 --cut N,W",
+    )
+    parser.add_argument("-b", "--broadcasts", help='Number of broadcasts (default: %(default)s)', type=int, default=MOCK_SETTINGS['broadcasts'], metavar='N')
+    parser.add_argument("-d", "--duration", help='Duration of each broadcast in hours (default: %(default)s)', type=float, default=MOCK_SETTINGS['duration']/3600, metavar='HOURS')
+    parser.add_argument("--throttle", help='Limit audio downloads to this many kByte/s per connection (default: %(default)s)', type=int, default=None, metavar='KBYTE')
+    parser.add_argument("--fail-rate", help='Share of requests that fail, from 0 to 1 (default: %(default)s)', type=float, default=MOCK_SETTINGS['fail_rate'], metavar='RATE')
+    parser.add_argument("--seed", help='Seed for random data and failures (default: %(default)s)', type=int, default=MOCK_SETTINGS['seed'])
+    parser.add_argument("--startup", help='Measure startup instead: N runs of --help and of a run with nothing to do (default: %(default)s)', type=int, default=None, metavar='N')
+    parser.add_argument("--json", help='Also save results as JSON in this file (default: %(default)s)', default=None, metavar='FILE')
+    parser.add_argument("script_args", help='Arguments for fm4-7tage-download.py', nargs=argparse.REMAINDER)
+
+    args = parser.parse_args()
+
+    settings = {
+        **MOCK_SETTINGS,
+        'broadcasts': max(1, args.broadcasts),
+        'duration': max(60, round(args.duration * 3600)),
+        'throttle': args.throttle*1024 if args.throttle else None,
+        'fail_rate': min(max(args.fail_rate, 0.0), 1.0),
+        'seed': args.seed,
+    }
+    script_args = args.script_args[1:] if args.script_args[:1] == ['--'] else args.script_args
+
+    if args.startup:
+        results = run_startup_benchmark(script_args, settings, max(1, args.startup))
+        print_startup_report(results)
+    else:
+        results = run_benchmark(script_args, settings)
+        print()
+        print_report(results)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
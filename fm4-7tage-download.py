@@ -4,20 +4,30 @@ import sys
 import urllib.parse
 import os
 import re
+import json
+import hashlib
+import sqlite3
+import bisect
+import array
 import time
 from datetime import datetime
 import argparse
 import io
+import itertools
+import functools
 import signal
+import shutil
+import glob
+import threading
+import concurrent.futures
+import heapq
+import importlib.util
 
-from mutagen.id3 import ID3,ID3NoHeaderError,TRSN,TRSO,TPE1,TALB,TRCK,TIT2,COMM,TYER,TDAT,TIME,TLEN,CTOC,CHAP,WOAS,WORS,TCON,APIC,CTOCFlags,PictureType
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-try:
-    import av
-    PYAV_AVAILABLE = True
-except ImportError:
-    PYAV_AVAILABLE = False
+# mutagen, cProfile and tomllib get imported when needed, so runs with nothing to do start faster
 
 
 # Preferences
@@ -27,57 +37,584 @@ STATION_INFO = {
     'player_search_url': "https://audioapi-v2.orf.at/radiothek/api/2.0/search/?q={query}&station=fm4&excludeType=M&excludeType=ML&excludeType=DJ&entity=broadcast&limit={limit}&offset={offset}",
 }
 
+# Network settings, shared by all requests
+HTTP_SETTINGS = {
+    'timeout': 5,           # seconds
+    'retries': 3,           # retries of failed connections and of responses with status in 'retry_status'
+    'backoff_factor': 1,    # wait 0s, 2s, 4s, ... between retries
+    'retry_status': [429, 500, 502, 503, 504],
+    'pool_size': 10,        # kept-alive connections per host
+    'compression': True,    # ask server for gzip/deflate compressed responses
+    'offline': False,       # do not use network at all, only cached data
+    'parallel_requests': 4, # maximum number of parallel requests for search pages and broadcast data
+}
+
+# Audio is binary data and gets downloaded in byte ranges, never let the server compress it
+AUDIO_HEADERS = {'Accept-Encoding': 'identity'}
+
+SESSION = {
+    'session': None,
+    'lock': threading.Lock(),
+}
+
+# On-disk cache for broadcast JSON and images
+CACHE_SETTINGS = {
+    'enabled': True,
+    'directory': os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'fm4-7tage-download'),
+    'ttl': 24*3600,               # seconds until cached data gets revalidated with the server
+    'max_size': 200*1024*1024,    # bytes, least recently used entries get evicted beyond this
+    'size': None,                 # current size, determined on first use
+    'lock': threading.Lock(),
+}
+
+# Images embedded in ID3 tags
+IMAGE_SETTINGS = {
+    'max_width': None,        # pixels, maximum width of chapter images
+    'budget': None,           # bytes, maximum total size of all images in a file
+    'differing_only': False,  # only add chapter images that differ from the cover image
+}
+
+# Index of downloaded broadcasts
+ARCHIVE_INDEX = {
+    'filepath': None,                   # None: use 'filename' in each target directory
+    'filename': '.fm4-archive.sqlite',
+    'connections': {},
+    'lock': threading.Lock(),
+}
+
+# Cut audio while downloading
+STREAM_CUT = {
+    'enabled': False,
+}
+
+# Metrics of this run, see --metrics and --profile
+METRICS = {
+    'filepath': None,               # write report to this file, Prometheus textfile format if it ends with .prom, JSON otherwise
+    'profile': None,                # cProfile.Profile for cut and tag stages, None: do not profile
+    'profile_lock': threading.Lock(),
+    'started': time.time(),
+    'stages': {},                   # metrics of each stage: calls, seconds, and counters
+    'counters': {},                 # counters of whole run: requests, retries, bytes, ...
+    'current': threading.local(),   # stage each thread is in
+    'lock': threading.Lock(),
+}
+
+# Watch mode: download broadcasts as soon as they have ended
+WATCH_SETTINGS = {
+    'delay': 300,                               # seconds after a broadcast's end until the first download attempt
+    'refresh': 6*3600,                          # seconds between searches for new broadcasts
+    'backoff_min': 120,                         # first retry delay in seconds, doubled on each further attempt
+    'backoff_max': 3600,
+    'max_attempts': 12,
+}
+
+# Integrity checks of saved files, see verify_audio() and --verify
+VERIFY_SETTINGS = {
+    'tolerance': 5000,          # minimum difference in ms between audio duration and TLEN tag regarded as error
+    'tolerance_share': 0.01,    # ... or this share of the duration, whatever is bigger
+    'available_days': 7,        # FM4 keeps broadcasts for seven days, after that they cannot be downloaded again
+}
+
+# Directory (within target directory) for original, uncut audio files and broadcast JSON
+ORIGINALS_DIRECTORY = '.originals'
+
+# Bitrates in kbit/s by (MPEG 1?, layer)
+MPEG_BITRATES = {
+    (True, 1):  [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2):  [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3):  [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+# Sample rates in Hz by MPEG version (0: MPEG 2.5, 2: MPEG 2, 3: MPEG 1)
+MPEG_SAMPLE_RATES = {
+    0: [11025, 12000, 8000],
+    2: [22050, 24000, 16000],
+    3: [44100, 48000, 32000],
+}
+
+# Compiled patterns for strip_html()
+HTML_PATTERNS = {
+    'br': re.compile(r'(<br/?>)', flags=re.IGNORECASE),
+    'paragraphs': re.compile(r'\s*(</p>)\s*(<p>)\s*', flags=re.IGNORECASE),
+    # A tag runs from < to the next > outside of quotes, or to the end of the text. A stray > gets removed, too.
+    'tag': re.compile(r'<(?:[^"\'>]|["\'][^"\']*(?:["\']|$))*>?|>'),
+    'spaces': re.compile(r'\s\s+'),
+}
+
+# Search results of this run, by query
+SEARCH_RESULTS = {}
+
+# Tie breaker for watch mode's schedule entries with the same due time
+WATCH_SEQUENCE = itertools.count()
+
+# Set on CTRL-C, tells running downloads to stop
+ABORT = threading.Event()
+
+# Concurrent downloads per host
+HOST_SLOTS = {
+    'max_per_host': 2,
+    'semaphores': {},
+    'lock': threading.Lock(),
+}
+
+# Bandwidth limits for audio downloads, shared by all downloads (token buckets)
+BANDWIDTH = {
+    'rate': None,           # bytes per second for all downloads together, None: unlimited
+    'host_rates': {},       # bytes per second for all downloads from a host, '*' for any other host
+    'buckets': {},          # token bucket of all downloads (key None) and of each host
+    'lock': threading.Lock(),
+}
+
+# Orders of downloads across all shows for --priority: newest broadcasts first, or broadcasts expiring first
+PRIORITIES = [ 'newest', 'expiring' ]
+
 
 def interrupt_handler(signum, frame):
     """
     Exit cleanly on CTRL-C
     """
+    ABORT.set()
     sys.exit()
 
 
-def get_all_broadcasts(show_title):
+def count_metric(name, value=1, stage=None):
     """
-    Search for broadcasts of a show
-    Return list with JSON data of each broadcast
+    Add value to counter name of the whole run, and of stage (default: the stage the current thread is in, see timed_stage())
+    """
+
+    stage = stage or getattr(METRICS['current'], 'stage', None)
+    with METRICS['lock']:
+        METRICS['counters'][name] = METRICS['counters'].get(name, 0) + value
+        if stage:
+            stage_metrics = METRICS['stages'].setdefault(stage, { 'calls': 0, 'seconds': 0.0 })
+            stage_metrics[name] = stage_metrics.get(name, 0) + value
+
+
+def timed_stage(stage, profile=False):
+    """
+    Decorator recording calls and duration of a function in METRICS, as stage of the run
+    Counters raised by count_metric() while the function runs are added to the stage, too.
+    With profile=True the function is profiled if --profile is given; profiled stages then run one at a time.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            current = METRICS['current']
+            outer_stage = getattr(current, 'stage', None)
+            current.stage = stage
+            start = time.perf_counter()
+            try:
+                if profile and METRICS['profile']:
+                    with METRICS['profile_lock']:
+                        METRICS['profile'].enable()
+                        try:
+                            return function(*args, **kwargs)
+                        finally:
+                            METRICS['profile'].disable()
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                current.stage = outer_stage
+                with METRICS['lock']:
+                    stage_metrics = METRICS['stages'].setdefault(stage, { 'calls': 0, 'seconds': 0.0 })
+                    stage_metrics['calls'] += 1
+                    stage_metrics['seconds'] += seconds
+        return wrapper
+    return decorator
+
+
+def get_metrics_report():
+    """
+    Return metrics of this run as dict
+    """
+
+    with METRICS['lock']:
+        stages = { stage: dict(stage_metrics) for stage, stage_metrics in METRICS['stages'].items() }
+        counters = dict(METRICS['counters'])
+
+    images = counters.get('image_cache_hits', 0) + counters.get('image_cache_misses', 0)
+    return {
+        'started': datetime.fromtimestamp(METRICS['started']).astimezone().isoformat(),
+        'seconds': time.time() - METRICS['started'],
+        'stages': stages,
+        'counters': counters,
+        'image_cache_hit_rate': counters.get('image_cache_hits', 0) / images if images else None,
+    }
+
+
+def format_prometheus(report):
+    """
+    Format metrics report as Prometheus text (for node exporter's textfile collector)
+    """
+
+    lines = [
+        '# HELP fm4_run_started_seconds Start time of this run',
+        '# TYPE fm4_run_started_seconds gauge',
+        f'fm4_run_started_seconds {datetime.fromisoformat(report["started"]).timestamp()}',
+        '# HELP fm4_run_duration_seconds Duration of this run',
+        '# TYPE fm4_run_duration_seconds gauge',
+        f'fm4_run_duration_seconds {report["seconds"]}',
+    ]
+    if report['image_cache_hit_rate'] is not None:
+        lines += [
+            '# HELP fm4_image_cache_hit_ratio Share of images of this run served from cache',
+            '# TYPE fm4_image_cache_hit_ratio gauge',
+            f'fm4_image_cache_hit_ratio {report["image_cache_hit_rate"]}',
+        ]
+    for name, value in sorted(report['counters'].items()):
+        lines += [
+            f'# HELP fm4_{name} Number of {name.replace("_", " ")} in this run',
+            f'# TYPE fm4_{name} gauge',
+            f'fm4_{name} {value}',
+        ]
+
+    names = sorted(set(itertools.chain.from_iterable(report['stages'].values())))
+    for name in names:
+        lines += [
+            f'# HELP fm4_stage_{name} Stage {name.replace("_", " ")} in this run',
+            f'# TYPE fm4_stage_{name} gauge',
+        ]
+        for stage, stage_metrics in sorted(report['stages'].items()):
+            if name in stage_metrics:
+                lines.append(f'fm4_stage_{name}{{stage="{stage}"}} {stage_metrics[name]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(filepath):
+    """
+    Write metrics report of this run to filepath, as Prometheus text if filepath ends with .prom, as JSON otherwise
+    The file gets replaced atomically, so readers never see a partial report.
+    """
+
+    report = get_metrics_report()
+    with open(filepath + '.temp', 'w') as report_file:
+        if filepath.endswith('.prom'):
+            report_file.write(format_prometheus(report))
+        else:
+            json.dump(report, report_file, indent=2)
+    os.replace(filepath + '.temp', filepath)
+
+
+def get_session():
+    """
+    Return the shared requests session, create it on first use
+    All requests go through this session, so connections get pooled and kept alive
+    """
+
+    with SESSION['lock']:
+        if SESSION['session'] is None:
+            retry = Retry(
+                total=HTTP_SETTINGS['retries'],
+                backoff_factor=HTTP_SETTINGS['backoff_factor'],
+                status_forcelist=HTTP_SETTINGS['retry_status'],
+                allowed_methods=['GET', 'HEAD'],
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_SETTINGS['pool_size'],
+                pool_maxsize=HTTP_SETTINGS['pool_size'],
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['Accept-Encoding'] = 'gzip, deflate' if HTTP_SETTINGS['compression'] else 'identity'
+            SESSION['session'] = session
+        return SESSION['session']
+
+
+def http_get(url, **kwargs):
+    """
+    Send GET request using the shared session and the configured timeout
+    Return response
+    """
+
+    if HTTP_SETTINGS['offline']:
+        raise requests.ConnectionError(f"Offline, not fetching {url}")
+
+    kwargs.setdefault('timeout', HTTP_SETTINGS['timeout'])
+    response = get_session().get(url, **kwargs)
+
+    count_metric('requests')
+    retries = getattr(response.raw, 'retries', None)
+    if retries and retries.history:
+        count_metric('retries', len(retries.history))
+    return response
+
+
+def cache_paths(url):
+    """
+    Return paths of metadata file and data file of url's cache entry
+    """
+
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return (
+        os.path.join(CACHE_SETTINGS['directory'], key + '.json'),
+        os.path.join(CACHE_SETTINGS['directory'], key + '.data'),
+    )
+
+
+def cache_store(url, response):
+    """
+    Store response in cache and evict least recently used entries if cache has grown too big
+    """
+
+    meta_filepath, data_filepath = cache_paths(url)
+    meta = {
+        'url': url,
+        'fetched': time.time(),
+        'content_type': response.headers.get('content-type'),
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'size': len(response.content),
+    }
+
+    with CACHE_SETTINGS['lock']:
+        os.makedirs(CACHE_SETTINGS['directory'], exist_ok=True)
+
+        if CACHE_SETTINGS['size'] is None:
+            CACHE_SETTINGS['size'] = sum(entry.stat().st_size for entry in os.scandir(CACHE_SETTINGS['directory']) if entry.name.endswith('.data'))
+        if os.path.isfile(data_filepath):
+            CACHE_SETTINGS['size'] -= os.path.getsize(data_filepath)
+
+        with open(data_filepath + '.temp', 'wb') as data_file:
+            data_file.write(response.content)
+        os.replace(data_filepath + '.temp', data_filepath)
+        with open(meta_filepath + '.temp', 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(meta_filepath + '.temp', meta_filepath)
+        CACHE_SETTINGS['size'] += meta['size']
+
+        if CACHE_SETTINGS['size'] > CACHE_SETTINGS['max_size']:
+            # Metadata files' mtime is the time of last use
+            entries = sorted(
+                (entry for entry in os.scandir(CACHE_SETTINGS['directory']) if entry.name.endswith('.json')),
+                key=lambda entry: entry.stat().st_mtime
+            )
+            for entry in entries:
+                if CACHE_SETTINGS['size'] <= CACHE_SETTINGS['max_size']:
+                    break
+                evict_filepath = entry.path[:-len('.json')] + '.data'
+                try:
+                    CACHE_SETTINGS['size'] -= os.path.getsize(evict_filepath)
+                    os.remove(evict_filepath)
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+def cached_get(url, ttl=None):
+    """
+    Get url from on-disk cache, or from network if not cached or older than ttl seconds (default: configured TTL)
+    Expired entries get revalidated with If-None-Match/If-Modified-Since, unless offline
+    Return dict {'status': HTTP status code, 'content': binary data, 'content_type': mime type,
+                 'cache': 'hit', 'revalidated', 'miss', or None if cache is disabled}
+    """
+
+    if ttl is None:
+        ttl = CACHE_SETTINGS['ttl']
+
+    if not CACHE_SETTINGS['enabled']:
+        response = http_get(url)
+        count_metric('bytes', len(response.content))
+        return { 'status': response.status_code, 'content': response.content, 'content_type': response.headers.get('content-type'), 'cache': None }
+
+    meta_filepath, data_filepath = cache_paths(url)
+    try:
+        with open(meta_filepath, 'r') as meta_file:
+            meta = json.load(meta_file)
+        with open(data_filepath, 'rb') as data_file:
+            content = data_file.read()
+        if len(content) != meta['size']:
+            raise ValueError("Incomplete cache entry")
+        # Mark as recently used
+        os.utime(meta_filepath)
+    except (OSError, ValueError, KeyError):
+        meta = None
+
+    if meta and (time.time() - meta['fetched'] < ttl or HTTP_SETTINGS['offline']):
+        return { 'status': 200, 'content': content, 'content_type': meta['content_type'], 'cache': 'hit' }
+
+    headers = {}
+    if meta and meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta and meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    response = http_get(url, headers=headers)
+
+    if response.status_code == 304 and meta:
+        # Unchanged on server, cached data is still valid
+        meta['fetched'] = time.time()
+        with open(meta_filepath + '.temp', 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(meta_filepath + '.temp', meta_filepath)
+        return { 'status': 200, 'content': content, 'content_type': meta['content_type'], 'cache': 'revalidated' }
+
+    count_metric('bytes', len(response.content))
+    if response.status_code == 200:
+        try:
+            cache_store(url, response)
+        except OSError as e:
+            print(f"WARNING: Could not write to cache: {e}", file=sys.stderr)
+
+    return { 'status': response.status_code, 'content': response.content, 'content_type': response.headers.get('content-type'), 'cache': 'miss' }
+
+
+@timed_stage('search')
+def get_search_results(query):
+    """
+    Search for broadcasts matching query
+    Return list with all search results
+    Results are kept for the rest of the run, so shows with the same query share a single search
     """
 
+    query = query.strip().lower()
+    if query in SEARCH_RESULTS:
+        return SEARCH_RESULTS[query]
+
     # search results are paginated
-    query = urllib.parse.quote_plus(show_title)
-    limit = 20
-    offset = 0
-    search_results = []
-    while True:
-        results_json = requests.get(STATION_INFO['player_search_url'].format(query=query, limit=limit, offset=offset), timeout=5).json()
-        if results_json['length'] == 0:
-            break
-        search_results += results_json['payload']
-        offset += limit
+    quoted_query = urllib.parse.quote_plus(query)
+    limit = 100
+
+    @timed_stage('search_page')
+    def get_page(offset):
+        # New broadcasts show up in search results any time, so always revalidate them
+        return json.loads(cached_get(STATION_INFO['player_search_url'].format(query=quoted_query, limit=limit, offset=offset), ttl=0)['content'])
+
+    results_json = get_page(0)
+    search_results = list(results_json['payload'])
+    page_size = len(search_results)
+    total = results_json.get('total')
+
+    if page_size and isinstance(total, int):
+        # Number of results is known, get all remaining pages in parallel
+        with concurrent.futures.ThreadPoolExecutor(HTTP_SETTINGS['parallel_requests']) as pool:
+            for results_json in pool.map(get_page, range(page_size, total, page_size)):
+                search_results += results_json['payload']
+    else:
+        # Get one page after another until there are no more results.
+        # The server may return fewer results per page than asked for
+        offset = page_size
+        while results_json['payload']:
+            results_json = get_page(offset)
+            search_results += results_json['payload']
+            offset += len(results_json['payload'])
+
+    # Results may shift between pages while they get downloaded
+    unique_results = {}
+    for hit in search_results:
+        unique_results.setdefault(hit['data']['href'], hit)
+    search_results = list(unique_results.values())
+
+    SEARCH_RESULTS[query] = search_results
+    return search_results
+
+
+def clean_show_title(show_title):
+    """
+    Remove station's name from show's title, so that user may search for 'fm4 house of pain' or 'house of pain'
+    Return lower case title, to compare titles
+    """
+
+    return re.sub(r'^' + re.escape(STATION_INFO['name']) + r'[\-\s]*', '', show_title.strip(), flags=re.IGNORECASE).lower()
+
+
+@functools.lru_cache(maxsize=None)
+def get_title_matcher(show_titles):
+    """
+    Compile a single regular expression matching broadcast titles of all shows in tuple show_titles,
+    with or without the station's name in front
+    Return function returning clean_show_title() of the matching show for a broadcast's title, None if no show matches
+    """
 
-    # loop through search results, for each result check if it's valid and get its broadcast json, with items
-    all_broadcasts = []
-    # For each search result, sorted from newest to oldest: fetch linked broadcasts
-    for hit in sorted(search_results, key=lambda x: x['data']['start'], reverse=True):
+    clean_titles = list(dict.fromkeys(clean_show_title(show_title) for show_title in show_titles))
+    pattern = re.compile(
+        r'^\s*(?:' + re.escape(STATION_INFO['name']) + r')?[\s\-]*(?:'
+        + '|'.join(f'(?P<show{num}>{re.escape(title)})' for num, title in enumerate(clean_titles))
+        + r')\s*$',
+        flags=re.IGNORECASE
+    )
+    titles_by_group = { f'show{num}': title for num, title in enumerate(clean_titles) }
+
+    def match(title):
+        result = pattern.match(title)
+        return titles_by_group[result.lastgroup] if result else None
+
+    return match
+
+
+def search_shows(show_titles, include_upcoming=False):
+    """
+    Search for broadcasts of several shows, and sort out the search results of all shows in one pass
+    Return dict with list of search results' data of each broadcast for each show title, sorted from newest to oldest
+    Search results contain the broadcast's title, start and end, but no items
+    Broadcasts that have not ended yet are only included if include_upcoming is True
+    """
+
+    show_titles = tuple(show_titles)
+    match = get_title_matcher(show_titles)
+    now = datetime.now().timestamp()
+
+    # Shows' searches may find the same broadcasts
+    hits = {}
+    for show_title in show_titles:
+        for hit in get_search_results(show_title):
+            hits.setdefault(hit['data']['href'], hit)
+
+    matching_results = { clean_show_title(show_title): [] for show_title in show_titles }
+    for hit in sorted(hits.values(), key=lambda x: x['data']['start'], reverse=True):
 
         # Skip broadcasts that have not ended yet
-        if datetime.fromisoformat(hit['data']['end']).timestamp() > datetime.now().timestamp():
+        if not include_upcoming and datetime.fromisoformat(hit['data']['end']).timestamp() > now:
             continue
 
-        # Remove station's name from show's title, so that user may search for 'fm4 house of pain' or 'house of pain'
-        clean_show_title = re.sub(r'^' + STATION_INFO['name'] + r'[\-\s]*', '', show_title, flags=re.IGNORECASE)
-        # Skip broadcast if title does match the wanted show's name, with or without the station's name in front
-        if not re.search(r'^\s*(?:' + STATION_INFO['name'] + r')?[\s\-]*' + clean_show_title + r'\s*$', hit['data']['title'], flags=re.IGNORECASE):
+        # Skip broadcast if title does not match any wanted show's name
+        clean_title = match(hit['data']['title'])
+        if clean_title is None:
             continue
 
-        # Download json of broadcast, including items (=chapters)
-        broadcast = requests.get(hit['data']['href'] + '?items=true', timeout=5).json()
-        all_broadcasts.append(broadcast['payload'])
+        matching_results[clean_title].append(hit['data'])
+
+    return { show_title: matching_results[clean_show_title(show_title)] for show_title in show_titles }
+
+
+def search_broadcasts(show_title, include_upcoming=False):
+    """
+    Search for broadcasts of a show
+    Return list with search results' data of each broadcast, sorted from newest to oldest
+    Search results contain the broadcast's title, start and end, but no items
+    Broadcasts that have not ended yet are only included if include_upcoming is True
+    """
+
+    return search_shows([ show_title ], include_upcoming=include_upcoming)[show_title]
+
+
+@timed_stage('broadcast')
+def get_broadcast(search_result, ttl=None):
+    """
+    Download JSON of broadcast found by search_broadcasts(), including items (=chapters)
+    ttl overrides the cache's time to live. Cached JSON without streams gets revalidated regardless,
+    it was cached before the broadcast's audio got published.
+    """
 
-    return all_broadcasts
+    url = search_result['href'] + '?items=true'
+    response = cached_get(url, ttl=ttl)
+    broadcast = json.loads(response['content'])['payload']
+    if not broadcast.get('streams') and response['cache'] == 'hit':
+        broadcast = json.loads(cached_get(url, ttl=0)['content'])['payload']
+    return broadcast
 
 
 def create_filename(broadcast):
     """
     Construct a sensible filename for the broadcast
+    Only uses 'title' and 'start', so search results work as well as full broadcast data
     """
 
     show_name = strip_html(broadcast['title'])
@@ -167,40 +704,50 @@ def get_keepmarks(broadcast):
     return keepmarks
 
 
-def remove_chapters_from_keepmark(keepmark, chapters):
+def merge_intervals(intervals):
     """
-    Remove list of chapters from a keepmark
-    Return list of new keepmarks
-
-    This is used by remove_chaptertypes_from_keepmarks() to get rid of unwanted audio.
+    Merge overlapping and adjacent [start, end] intervals
+    Return sorted list of disjoint intervals
     """
-    for chapter_num, chapter in enumerate(chapters):
 
-        # Chaper starts after this keepmark. chapters are sorted by time, so we are done
-        if chapter['offset_start'] > keepmark[1]:
-            return [ keepmark ]
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
 
-        # Chapter has already ended before this keepmark -> head on with next chapter
-        if chapter['offset_end'] <= keepmark[0]:
-            continue
 
-        # Chapter spans whole keepmark -> ditch keepmark
-        if chapter['offset_start'] >= keepmark[0] and chapter['offset_end'] >=  keepmark[1]:
-            #return []
-            break
+def subtract_intervals(intervals, removals):
+    """
+    Remove all removals from intervals in a single sweep over both sorted lists
+    Intervals must not overlap each other.
+    Return sorted list of remaining, non-empty [start, end] intervals
+    """
+
+    removals = merge_intervals(removals)
+    result = []
+    removal_num = 0
+    for start, end in sorted(intervals):
+        # Skip removals that end before this interval starts.
+        # Intervals are sorted and do not overlap, so these removals can't affect later intervals either
+        while removal_num < len(removals) and removals[removal_num][1] <= start:
+            removal_num += 1
 
-        # Chapter starts before this keepmark and ends in this keepmark
-        if chapter['offset_start'] < keepmark[0]:
-            return remove_chapters_from_keepmark([chapter['offset_end'], keepmark[1]], chapters[chapter_num:])
+        # Cut all removals overlapping this interval out of it
+        position = start
+        num = removal_num
+        while num < len(removals) and removals[num][0] < end:
+            if removals[num][0] > position:
+                result.append([position, removals[num][0]])
+            position = max(position, removals[num][1])
+            num += 1
 
-        # Chapter starts and ends in this keepmark -> split it up into two, head on with right one
-        if chapter['offset_end'] <= keepmark[1]:
-            left = [ keepmark[0], chapter['offset_start'] ]
-            right = remove_chapters_from_keepmark([ min(chapter['offset_end'], keepmark[1]), keepmark[1]], chapters[chapter_num:])
-            return [ left ] + right
+        if position < end:
+            result.append([position, end])
 
-    # keepmark not affected by any chapter, return unmodified
-    return [ keepmark ]
+    return result
 
 
 def remove_chaptertypes_from_keepmarks(keepmarks, chapters, chapter_types):
@@ -209,27 +756,27 @@ def remove_chaptertypes_from_keepmarks(keepmarks, chapters, chapter_types):
     Return updated list of keepmarks
     """
 
-    unwanted_chapters = [ chapter for chapter in chapters if chapter['type'] in chapter_types ]
+    unwanted_chapters = [ [chapter['offset_start'], chapter['offset_end']] for chapter in chapters if chapter['type'] in chapter_types ]
 
     if not unwanted_chapters:
         return keepmarks
 
-    new_keepmarks = []
-    for keepmark in keepmarks:
-        new_keepmarks.extend(remove_chapters_from_keepmark(keepmark, unwanted_chapters))
-
-    return new_keepmarks
+    return subtract_intervals(keepmarks, unwanted_chapters)
 
 
 def align_chapters_to_keepmarks(chapters, keepmarks):
     """
     If audio segments get cut out, chapter start & end markers (or even both) may be in the removed parts of audio.
     Ensure every chapter contains audio (if not: drop it), and starts/ends at the proper time
+    Keepmarks must not overlap each other.
     """
 
     chapters = sorted(chapters, key=lambda x: x['offset_start'])
     keepmarks = sorted(keepmarks, key=lambda x: x[0])
 
+    keepmark_starts = [ keepmark[0] for keepmark in keepmarks ]
+    keepmark_ends = [ keepmark[1] for keepmark in keepmarks ]
+
     broadcast_duration = sum(offset_end - offset_start for offset_start, offset_end in keepmarks)
 
     # List with total duration of all gaps until each keepmark
@@ -245,42 +792,19 @@ def align_chapters_to_keepmarks(chapters, keepmarks):
     aligned_chapters = []
 
     for chapter in chapters:
-        new_offset_start = None
-        new_offset_end = None
-        skip_chapter_flag = False
-        # Walk through keepmarks from start to end, and set chapter start times
-        for keepmark_num, keepmark in enumerate(keepmarks):
-            if chapter['offset_end'] < keepmark[0]:
-                # Chapter ends before start of keepmark
-                # -> Skip chapter
-                skip_chapter_flag = True
-                break
-            if chapter['offset_start'] <= keepmark[1]:
-                # Chapter ends after start of keepmark (see if-clause above) and ends before end of keepmark
-                # -> Fix chapter's start time
-                new_offset_start = max(chapter['offset_start'], keepmark[0]) - gaps[keepmark_num]
-                break
-
-        if skip_chapter_flag:
+        # First keepmark ending after chapter's start
+        first = bisect.bisect_left(keepmark_ends, chapter['offset_start'])
+        if first == len(keepmarks) or chapter['offset_end'] < keepmark_starts[first]:
+            # Chapter lies completely in removed audio
             continue
 
-        # Walk through keepmarks from end to start, and set chapter end times
-        for keepmark_num, keepmark in reversed(list(enumerate(keepmarks))):
-            if chapter['offset_start'] > keepmark[1]:
-                # Chapter starts after end of keepmark
-                # -> Skip chapter
-                skip_chapter_flag = True
-                break
-            if chapter['offset_end'] >= keepmark[0]:
-                # Chapter starts before end of keepmark (see if-clause above) and ends after start of keepmark
-                # -> Fix chapter's end time
-                new_offset_end = min(chapter['offset_end'], keepmark[1]) - gaps[keepmark_num]
-                break
+        # Last keepmark starting before chapter's end
+        last = bisect.bisect_right(keepmark_starts, chapter['offset_end']) - 1
 
-        if skip_chapter_flag:
-            continue
+        new_offset_start = max(chapter['offset_start'], keepmark_starts[first]) - gaps[first]
+        new_offset_end = min(chapter['offset_end'], keepmark_ends[last]) - gaps[last]
 
-        if new_offset_start is not None and new_offset_end is not None and new_offset_start < new_offset_end:
+        if new_offset_start < new_offset_end:
             aligned_chapter=chapter.copy()
             aligned_chapter['offset_start'] = new_offset_start
             aligned_chapter['offset_end'] = min(new_offset_end, broadcast_duration)
@@ -289,212 +813,1159 @@ def align_chapters_to_keepmarks(chapters, keepmarks):
     return aligned_chapters
 
 
-def download_audio(url: str, max_attempts=4):
+def host_slot(url):
     """
-    Download audio data in chunks
-    Return as bytearray
+    Return semaphore limiting the number of concurrent downloads from url's host
     """
 
-    chunk_size = 128*1024  # 128 kByte
+    host = urllib.parse.urlsplit(url).netloc
+    with HOST_SLOTS['lock']:
+        if host not in HOST_SLOTS['semaphores']:
+            HOST_SLOTS['semaphores'][host] = threading.BoundedSemaphore(HOST_SLOTS['max_per_host'])
+        return HOST_SLOTS['semaphores'][host]
 
-    for attempt in range(1, max_attempts+1):
-        try:
-            data = bytearray()
-            with requests.get(url, stream=True, timeout=5) as response:
-                content_length = int(response.headers['Content-Length'])
-                response.raise_for_status()
-                for chunk in response.iter_content(chunk_size=chunk_size):
-                    data += chunk
-                    print(f"\rDownloading {url} ... {len(data)/(1024*1024):.1f}/{content_length/(1024*1024):.1f} MByte", end=" ", flush=True)
-            print("done")
-            return data
 
-        except:
-            time.sleep(3)  # Wait 3 seconds between download attempts
-            attempt += 1
-            continue
+def get_bucket(key, rate):
+    """
+    Return token bucket for key (None: all downloads, otherwise host), create it on first use
+    Bucket starts empty and holds up to one second of data (at least 256 kByte), so downloads may burst after pauses
+    """
 
-    print(f"ERROR: Failed to download {url}", file=sys.stderr)
-    return False
+    with BANDWIDTH['lock']:
+        if key not in BANDWIDTH['buckets']:
+            capacity = max(rate, 256*1024)
+            BANDWIDTH['buckets'][key] = {
+                'rate': rate,
+                'capacity': capacity,
+                'tokens': 0,
+                'updated': time.monotonic(),
+                'lock': threading.Lock(),
+            }
+        return BANDWIDTH['buckets'][key]
 
 
-def cut_audio(audio, keepmarks):
+def take_tokens(bucket, num_bytes):
     """
-    Remove everything outside "keepmarks" sections from mp3 data
+    Take num_bytes tokens from bucket, the bucket may go into debt
+    Return seconds to wait until the debt is paid off
     """
 
-    with av.open(io.BytesIO(audio), format='mp3') as input_container:
-        input_stream = input_container.streams.audio[0]
+    with bucket['lock']:
+        now = time.monotonic()
+        bucket['tokens'] = min(bucket['capacity'], bucket['tokens'] + (now - bucket['updated']) * bucket['rate'])
+        bucket['updated'] = now
+        bucket['tokens'] -= num_bytes
+        return -bucket['tokens'] / bucket['rate'] if bucket['tokens'] < 0 else 0
 
-        output_buffer = io.BytesIO()
-        with av.open(output_buffer, 'w', format='mp3') as output_container:
-            # set bit_rate to help mp3 players to calculate duration
-            output_container.add_stream('mp3', bit_rate=input_stream.bit_rate, rate=input_stream.rate)
 
-            keepmarks_iter = iter(sorted(keepmarks, key=lambda x: x[0]))
-            start, end = next(keepmarks_iter)
+def limit_bandwidth(url, num_bytes):
+    """
+    Account num_bytes just received from url, and wait as long as the global and the host's bandwidth limits require
+    """
 
-            for packet in input_container.demux(input_stream):
-                if packet.dts is None:
-                    # Skip "flushing" packets created by demux
-                    continue
+    wait = 0
+    if BANDWIDTH['rate']:
+        wait = take_tokens(get_bucket(None, BANDWIDTH['rate']), num_bytes)
 
-                timestamp = int(packet.pts * input_stream.time_base)
+    host = urllib.parse.urlsplit(url).hostname
+    host_rate = BANDWIDTH['host_rates'].get(host, BANDWIDTH['host_rates'].get('*'))
+    if host_rate:
+        wait = max(wait, take_tokens(get_bucket(host, host_rate), num_bytes))
 
-                if timestamp * 1000 < start:
-                    continue
-                elif timestamp * 1000 >= end:
-                    try:
-                        start, end = next(keepmarks_iter)
-                    except StopIteration:
-                        break
-                else:
-                    output_container.mux(packet)
+    if wait:
+        ABORT.wait(wait)
 
-            return output_buffer.getvalue()
 
+def sort_by_priority(entries, priority, get_search_result=lambda entry: entry):
+    """
+    Sort entries by priority: 'newest' broadcasts first, or broadcasts 'expiring' first (they are available for seven days after airing)
+    Return entries unchanged if priority is None
+    """
 
-def strip_html(text: str):
+    if priority is None:
+        return entries
+    return sorted(entries, key=lambda entry: get_search_result(entry)['start'], reverse=priority == 'newest')
+
+
+def load_download_state(filepath, url):
     """
-    Remove HTML tags from a string
+    Read sidecar of a partial download
+    Return dict with 'url', 'content_length', 'etag' and 'last_modified', or None if there's no usable partial download
     """
 
-    if text is None:
+    try:
+        with open(filepath + '.part.json', 'r') as state_file:
+            state = json.load(state_file)
+    except (OSError, ValueError):
         return None
 
-    # Add a | after <br/>
-    text = re.sub(r'(<br/?>)', r'\1 | ', text, flags=re.IGNORECASE)
+    if state.get('url') != url or not os.path.isfile(filepath + '.part'):
+        return None
 
-    # Add a | between </p></p>
-    text = re.sub(r'\s*(</p>)\s*(<p>)\s*', r'\1 | \2 ', text, flags=re.IGNORECASE)
-
-    tag = False
-    quote = False
-    out = ""
-    for c in text:
-        if c == '<' and not quote:
-            tag = True
-        elif c == '>' and not quote:
-            tag = False
-        elif (c in ('"', "'")) and tag:
-            quote = not quote
-        elif not tag:
-            out = out + c
+    return state
 
-    # Remove multiple consecutive spaces
-    out = re.sub(r'\s\s+', ' ', out)
 
-    return out.strip()
+def save_download_state(filepath, state):
+    """
+    Write sidecar of a partial download
+    """
+
+    with open(filepath + '.part.json.temp', 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(filepath + '.part.json.temp', filepath + '.part.json')
 
 
-def get_image(images_list):
+def discard_partial_download(filepath):
     """
-    Try to download biggest image using broadcast JSON's "images" entry
-    Return dict {'data': binary image data, 'mime': image mime type }
+    Remove partial download and its sidecar, so the next attempt starts over
     """
 
-    if not images_list:
-        return None
-
-    # get biggest (usually 600px width) image
-    for image_version in sorted(images_list[0]['versions'], key=lambda x: x['width'], reverse=True):
+    for suffix in ('.part', '.part.json'):
         try:
-            response = requests.get(image_version['path'], timeout=5)
-            if response.status_code == 200:
-                return {
-                    'data': response.content,
-                    'mime': response.headers['content-type'],
-                    'description': images_list[0].get('alt') or images_list[0].get('text'),
-                }
-        except:
-            # Try to get lower resolution image
-            continue
-    return None
+            os.remove(filepath + suffix)
+        except FileNotFoundError:
+            pass
 
 
-def get_genres(broadcast):
+def download_segment(url, fd, segment, state, lock, max_attempts=4):
     """
-    Retrieve list of genres from broadcast JSON's "orfcategories" entry
-    "categories" in "orfcategories" are either a string, or a key-value tuple
+    Download byte range [start, end] of a segment and write it into its slot of the preallocated file fd
+    Return True on success, False if all attempts failed, None if server does not support range requests or file has changed
     """
 
-    return [ i['categories'][-1] for i in broadcast['orfcategories'] ]
+    chunk_size = 128*1024  # 128 kByte
+    start, end = segment['start'], segment['end']
+
+    for attempt in range(1, max_attempts+1):
+        try:
+            headers = {'Range': f'bytes={start}-{end}'}
+            if state.get('etag') or state.get('last_modified'):
+                headers['If-Range'] = state.get('etag') or state.get('last_modified')
 
+            position = start
+            with host_slot(url), http_get(url, stream=True, headers={ **headers, **AUDIO_HEADERS }) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    # Range got ignored (or file on server has changed)
+                    return None
+                if int(response.headers['Content-Range'].rsplit('/', 1)[1]) != state['content_length']:
+                    # File on server has changed, segments we've got are useless
+                    return None
 
-def set_id3_tags(filepath, chapters, keepmarks, broadcast):
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if ABORT.is_set():
+                        return False
+                    chunk = chunk[:end + 1 - position]
+                    os.pwrite(fd, chunk, position)
+                    position += len(chunk)
+                    count_metric('bytes', len(chunk), stage='download')
+                    limit_bandwidth(url, len(chunk))
+                    with lock:
+                        state['received'] += len(chunk)
+
+            if position <= end:
+                raise ValueError(f"Segment {start}-{end} incomplete")
+            return True
+
+        except (requests.RequestException, OSError, ValueError, KeyError, IndexError):
+            # Retry only this segment, discard what we've got of it so far
+            with lock:
+                state['received'] -= position - start
+            count_metric('failed_download_attempts', stage='download')
+            time.sleep(3)  # Wait 3 seconds between download attempts
+            continue
+
+    return False
+
+
+def download_audio_segmented(url: str, filepath: str, segments: int, max_attempts=4, output=sys.stdout, progress=True):
     """
-    Set id3 tags on mp3 file
+    Download audio by splitting it into byte ranges and fetching them in parallel
+    Each segment gets written into its slot in the preallocated file filepath + '.part'.
+    Completed segments are recorded in the sidecar file (filepath + '.part.json'), so later runs only fetch missing segments.
+    Return True on success, False otherwise, and None if the server does not support range requests or the file has changed
     """
 
-    # Calculate audio duration
-    broadcast_duration = sum(end-start for start, end in keepmarks)
+    part_filepath = filepath + '.part'
 
-    # Create datetime object from broadcast's start time
-    broadcast_datetime = datetime.fromisoformat(broadcast['start'])
+    state = load_download_state(filepath, url)
+    if state and 'segments' not in state:
+        # Unfinished whole-file download, let download_audio() continue it
+        return None
 
-    broadcast_genres = ["Radio Recording"] + get_genres(broadcast)
+    if not state:
+        # Ask server for total size and whether it supports range requests
+        try:
+            with host_slot(url), http_get(url, stream=True, headers={ 'Range': 'bytes=0-0', **AUDIO_HEADERS }) as response:
+                response.raise_for_status()
+                if response.status_code != 206 or 'Content-Range' not in response.headers:
+                    return None
+                content_length = int(response.headers['Content-Range'].rsplit('/', 1)[1])
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+        except (requests.RequestException, ValueError, IndexError):
+            return None
+
+        segment_size = -(-content_length // segments)
+        state = {
+            'url': url,
+            'content_length': content_length,
+            'etag': etag,
+            'last_modified': last_modified,
+            'segments': [
+                { 'start': start, 'end': min(start + segment_size, content_length) - 1, 'done': False }
+                for start in range(0, content_length, segment_size)
+            ],
+        }
 
-    # Create sensible broadcast description
-    broadcast_description = "\n".join(filter(None, map(strip_html, [
-        broadcast.get('subtitle'),
-        broadcast.get('description'),
-        broadcast.get('pressRelease')
-    ])))
-    if not broadcast_description:
-        broadcast_description = broadcast_datetime.astimezone().strftime("%Y-%m-%d %H:%M")
+        # Preallocate file
+        with open(part_filepath, 'wb') as part_file:
+            part_file.truncate(content_length)
+        save_download_state(filepath, state)
 
-    # Remove (potentially) existing id3 tags
-    try:
-        tags = ID3(filepath)
-        tags.delete()
-    except ID3NoHeaderError:
-        tags = ID3()
+    content_length = state['content_length']
+    pending = [ segment for segment in state['segments'] if not segment['done'] ]
+    state['received'] = sum(segment['end'] + 1 - segment['start'] for segment in state['segments'] if segment['done'])
+    lock = threading.Lock()
+    range_unsupported = False
 
-    # Add new id3 tags
-    tags.add(TRSN(text=[STATION_INFO['name']]))                           # Internet radio station name
-    tags.add(TRSO(text=['ORF']))                                          # Internet radio station owner
+    fd = os.open(part_filepath, os.O_WRONLY)
     try:
-        tags.add(WOAS(url=broadcast['link']['url']))                      # Official audio source webpage
-    except (KeyError, TypeError):
-        pass
-    tags.add(WORS(url=STATION_INFO['website']))                           # Official Internet radio station homepage
-    tags.add(TCON(text=broadcast_genres))                                 # Content Description
+        with concurrent.futures.ThreadPoolExecutor(segments) as pool:
+            futures = { pool.submit(download_segment, url, fd, segment, state, lock, max_attempts): segment for segment in pending }
+            while futures:
+                done, _ = concurrent.futures.wait(futures, timeout=1)
+                for future in done:
+                    segment = futures.pop(future)
+                    result = future.result()
+                    if result is None:
+                        range_unsupported = True
+                    elif result:
+                        with lock:
+                            segment['done'] = True
+                            save_download_state(filepath, { k: v for k, v in state.items() if k != 'received' })
+                if progress:
+                    print(f"\rDownloading {url} in {segments} segments ... {state['received']/(1024*1024):.1f}/{content_length/(1024*1024):.1f} MByte", end=" ", file=output, flush=True)
+    finally:
+        os.close(fd)
+
+    if range_unsupported:
+        # Start over with a whole-file download
+        discard_partial_download(filepath)
+        return None
 
-    tags.add(TPE1(text=[strip_html(STATION_INFO['name'])]))               # Lead performer(s)/Soloist(s) -> "FM4"
-    tags.add(TALB(text=[strip_html(broadcast['title'])]))                 # Album/Movie/Show title
-    tags.add(TRCK(text=["1/1"]))                                          # Track number/Position in set
-    tags.add(TIT2(text=[broadcast_datetime.astimezone().strftime("%Y-%m-%d %H:%M")]))   # Title/songname/content description
+    if not all(segment['done'] for segment in state['segments']) or os.path.getsize(part_filepath) != content_length:
+        # Keep finished segments, next run will download the missing ones
+        print(f"ERROR: Failed to download {url}", file=sys.stderr)
+        return False
+
+    os.replace(part_filepath, filepath)
+    os.remove(filepath + '.part.json')
+    if progress:
+        print("done", file=output)
+    else:
+        print(f"Downloaded {url} ({content_length/(1024*1024):.1f} MByte) in {segments} segments", file=output)
+    return True
 
-    tags.add(COMM(lang="deu", desc="desc", text=[broadcast_description])) # Comments
 
-    tags.add(TYER(text=[broadcast_datetime.astimezone().strftime("%Y")]))              # Year of broadcast
-    tags.add(TDAT(text=[broadcast_datetime.astimezone().strftime("%d%m")]))            # Day and month of broadcast
-    tags.add(TIME(text=[broadcast_datetime.astimezone().strftime("%H%M")]))            # Time of broadcast
+def download_audio(url: str, filepath: str, max_attempts=4, output=sys.stdout, progress=True, segments=1):
+    """
+    Download audio data in chunks and write them to filepath as they arrive
+    Data is written to filepath + '.part' first, with a sidecar file (filepath + '.part.json')
+    recording URL, Content-Length, ETag and Last-Modified.
+    Interrupted downloads are continued with HTTP Range requests, by later attempts as well as by later runs.
+    If segments is greater than 1, the file gets downloaded in that many parallel byte ranges,
+    falling back to a whole-file download if the server does not support this.
+    Messages are written to output, a progress indicator only if progress is True.
+    Return True on success, False otherwise
+    """
 
-    tags.add(TLEN(text=[int(broadcast_duration)]))                        # Duration in ms
+    if segments > 1:
+        result = download_audio_segmented(url, filepath, segments, max_attempts=max_attempts, output=output, progress=progress)
+        if result is not None:
+            return result
 
-    # Try to download and add cover image
-    image = get_image(broadcast.get('images'))
-    if image:
-        tags.add(APIC(
-            type=PictureType.COVER_FRONT,
-            desc=image['description'],
-            mime=image['mime'],
-            data=image['data']
-        ))
+    chunk_size = 128*1024  # 128 kByte
+    part_filepath = filepath + '.part'
 
-    # Chapters
-    # ID3 forbids multiple chapters having the same start time
-    #  -> If multiple chapters start at the same time, start with the longest one and add 1ms to each following
-    previous_offset_start = -1
-    for chapter in sorted(chapters, key=lambda x: (x['offset_start'], 1/x['offset_end'])):
-        sub_frames = []
+    for attempt in range(1, max_attempts+1):
+        try:
+            state = load_download_state(filepath, url)
+            if state and 'segments' in state:
+                # Leftover of a segmented download, file has holes -> start over
+                state = None
+            offset = os.path.getsize(part_filepath) if state else 0
+
+            headers = {}
+            if offset:
+                headers['Range'] = f'bytes={offset}-'
+                # Only continue if file on server has not changed in the meantime, otherwise server sends whole file
+                if state.get('etag') or state.get('last_modified'):
+                    headers['If-Range'] = state.get('etag') or state.get('last_modified')
+
+            with host_slot(url), http_get(url, stream=True, headers={ **headers, **AUDIO_HEADERS }) as response:
+                if response.status_code == 416 and offset:
+                    if offset != state['content_length']:
+                        # Partial download is unusable, start over with next attempt
+                        os.remove(filepath + '.part.json')
+                        raise ValueError("Server rejected range request")
+                    # Nothing left to download
+                    content_length = offset
+                else:
+                    response.raise_for_status()
+
+                    if response.status_code == 206 and offset:
+                        # Continue partial download
+                        content_length = state['content_length']
+                        if int(response.headers['Content-Range'].rsplit('/', 1)[1]) != content_length:
+                            # Partial download is unusable, start over with next attempt
+                            discard_partial_download(filepath)
+                            raise ValueError("Size of file on server has changed")
+                        mode = 'ab'
+                    else:
+                        # Server sent whole file
+                        offset = 0
+                        content_length = int(response.headers['Content-Length'])
+                        mode = 'wb'
+                        save_download_state(filepath, {
+                            'url': url,
+                            'content_length': content_length,
+                            'etag': response.headers.get('ETag'),
+                            'last_modified': response.headers.get('Last-Modified'),
+                        })
+
+                    received = offset
+                    with open(part_filepath, mode) as output_file:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            if ABORT.is_set():
+                                # Keep partial download, next run will continue it
+                                return False
+                            output_file.write(chunk)
+                            received += len(chunk)
+                            count_metric('bytes', len(chunk))
+                            limit_bandwidth(url, len(chunk))
+                            if progress:
+                                print(f"\rDownloading {url} ... {received/(1024*1024):.1f}/{content_length/(1024*1024):.1f} MByte", end=" ", file=output, flush=True)
+
+            # Check if we got everything
+            if os.path.getsize(part_filepath) != content_length:
+                raise ValueError(f"Got {os.path.getsize(part_filepath)} of {content_length} bytes")
+
+            os.replace(part_filepath, filepath)
+            os.remove(filepath + '.part.json')
+            if progress:
+                print("done", file=output)
+            else:
+                print(f"Downloaded {url} ({content_length/(1024*1024):.1f} MByte)", file=output)
+            return True
+
+        except (requests.RequestException, OSError, ValueError, KeyError, IndexError):
+            count_metric('failed_download_attempts')
+            time.sleep(3)  # Wait 3 seconds between download attempts
+            continue
 
-        chapter_title = chapter.get('title')
-        if chapter_title:
+    # Keep partial download, next run will continue it
+    print(f"ERROR: Failed to download {url}", file=sys.stderr)
+    return False
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_frame_header(header):
+    """
+    Parse 4 byte MPEG audio frame header (bytes)
+    Headers of a stream differ only in a few bits, so results get cached
+    Return dict with frame's properties, or None if header is not valid
+    """
+
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+
+    version = (header[1] >> 3) & 0x03       # 0: MPEG 2.5, 2: MPEG 2, 3: MPEG 1
+    layer = 4 - ((header[1] >> 1) & 0x03)   # 1, 2 or 3 (4: reserved)
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x03
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        # reserved values or free format
+        return None
+
+    bitrate = MPEG_BITRATES[(version == 3, layer)][bitrate_index] * 1000
+    sample_rate = MPEG_SAMPLE_RATES[version][sample_rate_index]
+    padding = (header[2] >> 1) & 0x01
+    mono = (header[3] >> 6) == 3
+
+    if layer == 1:
+        samples = 384
+        size = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2 or version == 3:
+        samples = 1152
+        size = 144 * bitrate // sample_rate + padding
+    else:
+        samples = 576
+        size = 72 * bitrate // sample_rate + padding
+
+    # Xing/Info header follows Layer III side information
+    side_info_size = (17 if mono else 32) if version == 3 else (9 if mono else 17)
+
+    return {
+        'version': version,
+        'layer': layer,
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'samples': samples,
+        'size': size,
+        'crc': not (header[1] & 0x01),
+        'mono': mono,
+        'side_info_size': side_info_size,
+    }
+
+
+def get_id3v2_size(data):
+    """
+    Return size of ID3v2 tag at start of data, 0 if there's none
+    """
+
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def parse_info_frame(frame, header):
+    """
+    Check whether the first frame is a Xing/Info or VBRI frame (a silent frame carrying metadata, not audio)
+    Return number of audio frames it declares (None if unknown), or False if it's a regular audio frame
+    """
+
+    xing_offset = 4 + (2 if header['crc'] else 0) + header['side_info_size']
+    tag = frame[xing_offset:xing_offset+4]
+    if tag in (b'Xing', b'Info'):
+        flags = int.from_bytes(frame[xing_offset+4:xing_offset+8], 'big')
+        if flags & 0x01:
+            return int.from_bytes(frame[xing_offset+8:xing_offset+12], 'big')
+        return None
+
+    if frame[36:40] == b'VBRI':
+        return int.from_bytes(frame[50:54], 'big')
+
+    return False
+
+
+def build_frame_index(filepath):
+    """
+    Walk through all MPEG audio frames of an MP3 file in a single pass
+    Return dict with
+        'offsets': byte offset of each audio frame, followed by the end offset of the last frame
+        'gaps': numbers of frames not directly following their predecessor (garbage in between), sorted
+        'gap_ends': for each gap, the byte offset where the frame before the gap ends
+        'frame_duration': duration of a frame in ms
+        'header': header of first audio frame
+        'header_bytes': raw 4 header bytes of first audio frame
+        'vbr': True if the bitrate changes between frames
+        'declared_frames': number of frames according to Xing/VBRI header, None if there is none
+    Xing/Info/VBRI frames, ID3 tags and garbage are not part of the index.
+    """
+
+    chunk_size = 1024*1024  # 1 MByte
+    max_frame_size = 8192
+
+    offsets = array.array('q')
+    gaps = []
+    gap_ends = []
+    reference = None
+    first_audio_header = None
+    header_bytes = None
+    vbr = False
+    declared_frames = None
+    expected_offset = None
+
+    with open(filepath, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        start = get_id3v2_size(f.read(10))
+        f.seek(start)
+        buffer = f.read(chunk_size)
+        buffer_offset = start
+        pos = 0
+
+        while True:
+            if len(buffer) - pos < max_frame_size and buffer_offset + len(buffer) < file_size:
+                buffer = buffer[pos:] + f.read(chunk_size)
+                buffer_offset += pos
+                pos = 0
+            if len(buffer) - pos < 4:
+                break
+
+            header = parse_frame_header(buffer[pos:pos+4])
+            if header and reference and any(header[k] != reference[k] for k in ('version', 'layer', 'sample_rate')):
+                # Frames of a stream do not change these, must be a false sync
+                header = None
+
+            if header and buffer_offset + pos != expected_offset:
+                # Not where we expected a frame (we're resyncing): only trust it if another frame follows
+                following = buffer[pos+header['size']:pos+header['size']+4]
+                if buffer_offset + pos + header['size'] != file_size and not parse_frame_header(following):
+                    header = None
+
+            if not header:
+                # Search next frame sync
+                next_pos = buffer.find(b'\xff', pos + 1)
+                pos = next_pos if next_pos != -1 else len(buffer)
+                continue
+
+            if len(buffer) - pos < header['size']:
+                # Truncated last frame
+                break
+
+            offset = buffer_offset + pos
+            if reference is None:
+                reference = header
+                info = parse_info_frame(buffer[pos:pos+header['size']], header)
+                if info is not False:
+                    # Metadata frame, not audio
+                    declared_frames = info
+                    pos += header['size']
+                    expected_offset = offset + header['size']
+                    continue
+
+            if first_audio_header is None:
+                first_audio_header = header
+                header_bytes = buffer[pos:pos+4]
+            elif header['bitrate'] != first_audio_header['bitrate']:
+                vbr = True
+
+            if offsets and offset != expected_offset:
+                gaps.append(len(offsets))
+                gap_ends.append(expected_offset)
+            offsets.append(offset)
+            pos += header['size']
+            expected_offset = offset + header['size']
+
+    if first_audio_header is None:
+        raise ValueError(f"No MPEG audio frames found in {filepath}")
+
+    # End of last frame
+    offsets.append(expected_offset)
+
+    return {
+        'offsets': offsets,
+        'gaps': gaps,
+        'gap_ends': gap_ends,
+        'frame_duration': first_audio_header['samples'] * 1000 / first_audio_header['sample_rate'],
+        'header': first_audio_header,
+        'header_bytes': header_bytes,
+        'vbr': vbr,
+        'declared_frames': declared_frames,
+    }
+
+
+def get_keepmark_frame_ranges(keepmarks, frame_duration, num_frames=None):
+    """
+    Translate keepmarks (in ms) into ranges of frame numbers to keep
+    A frame is kept if its start time is within a keepmark, rounded to the nearest frame boundary.
+    Frames are evenly spaced in time, so a timestamp's frame number is a simple division.
+    Return list of [first, last) frame number ranges, limited to num_frames frames if given
+    """
+
+    frame_ranges = []
+    for start, end in keepmarks:
+        first = max(round(start / frame_duration), 0)
+        last = max(round(end / frame_duration), first)
+        if num_frames is not None:
+            first = min(first, num_frames)
+            last = min(last, num_frames)
+        if first < last:
+            frame_ranges.append([first, last])
+
+    return merge_intervals(frame_ranges)
+
+
+def get_frame_byte_ranges(frame_index, frame_ranges):
+    """
+    Translate ranges of frame numbers into byte ranges of the file
+    Garbage between frames does not get copied, ranges get split at each gap (looked up by binary search).
+    Return list of [start, end] byte ranges
+    """
+
+    offsets = frame_index['offsets']
+    gaps = frame_index['gaps']
+
+    def range_end(last):
+        # Byte offset where the frame before frame number "last" ends
+        gap_num = bisect.bisect_left(gaps, last)
+        if gap_num < len(gaps) and gaps[gap_num] == last:
+            return frame_index['gap_ends'][gap_num]
+        return offsets[last]
+
+    byte_ranges = []
+    for first, last in frame_ranges:
+        gap_num = bisect.bisect_right(gaps, first)
+        while gap_num < len(gaps) and gaps[gap_num] < last:
+            byte_ranges.append([offsets[first], frame_index['gap_ends'][gap_num]])
+            first = gaps[gap_num]
+            gap_num += 1
+        byte_ranges.append([offsets[first], range_end(last)])
+
+    return merge_intervals(byte_ranges)
+
+
+def create_info_frame(header_bytes, vbr, num_frames, audio_size, frame_offset):
+    """
+    Create a Xing (VBR) or Info (CBR) frame for an MP3 file with num_frames frames of audio_size bytes in total
+    header_bytes is the header of the first audio frame, frame_offset(n) returns the offset of the n-th frame from the start of the audio.
+    The frame tells players the number of frames, the size and a seek table, so they show the correct duration.
+    Return frame as bytes
+    """
+
+    # Same stream properties as the audio, but without CRC and padding.
+    # Use the audio's bitrate, or a higher one if the frame would be too small
+    header_bytes = bytearray(header_bytes)
+    header_bytes[1] |= 0x01
+    header_bytes[2] &= 0xFD
+    # tag, flags, frames, bytes, 100 bytes TOC
+    xing_size = 4 + 4 + 4 + 4 + 100
+    while True:
+        frame_header = parse_frame_header(bytes(header_bytes))
+        xing_offset = 4 + frame_header['side_info_size'] if frame_header else 0
+        if frame_header and frame_header['size'] >= xing_offset + xing_size:
+            break
+        bitrate_index = (header_bytes[2] >> 4) + 1
+        if bitrate_index > 14:
+            raise ValueError("Cannot create Xing header for this stream")
+        header_bytes[2] = (bitrate_index << 4) | (header_bytes[2] & 0x0F)
+
+    frame_size = frame_header['size']
+    total_size = frame_size + audio_size
+
+    # Seek table: position of each percent of the duration, as fraction (0-255) of the file size
+    toc = bytearray(100)
+    if num_frames:
+        for percent in range(100):
+            toc[percent] = min(255, (frame_size + frame_offset(percent * num_frames // 100)) * 256 // total_size)
+
+    frame = bytearray(frame_size)
+    frame[0:4] = header_bytes
+    frame[xing_offset:xing_offset+xing_size] = (
+        (b'Xing' if vbr else b'Info')
+        + (0x07).to_bytes(4, 'big')          # frames, bytes and TOC present
+        + num_frames.to_bytes(4, 'big')
+        + total_size.to_bytes(4, 'big')
+        + bytes(toc)
+    )
+    return bytes(frame)
+
+
+def copy_file_range(input_file, output_file, start, end):
+    """
+    Copy bytes start to end of input_file to the current position of output_file
+    Data is copied inside the kernel (copy_file_range or sendfile) where possible
+    """
+
+    input_fd = input_file.fileno()
+    output_fd = output_file.fileno()
+    output_file.flush()
+    position = start
+
+    for copy in (
+        lambda count: os.copy_file_range(input_fd, output_fd, count, position),
+        lambda count: os.sendfile(output_fd, input_fd, position, count),
+    ):
+        try:
+            while position < end:
+                copied = copy(min(end - position, 1024*1024*1024))
+                if copied == 0:
+                    raise ValueError(f"{input_file.name} ends before byte {end}")
+                position += copied
+            return
+        except (AttributeError, OSError):
+            # Not supported by OS or file system, try next method.
+            # Output file's position has been advanced by what got copied so far
+            continue
+
+    # Plain read/write
+    input_file.seek(position)
+    while position < end:
+        data = input_file.read(min(1024*1024, end - position))
+        if not data:
+            raise ValueError(f"{input_file.name} ends before byte {end}")
+        output_file.write(data)
+        position += len(data)
+
+
+@timed_stage('cut', profile=True)
+def cut_audio(input_filepath, output_filepath, keepmarks):
+    """
+    Remove everything outside "keepmarks" sections from mp3 file input_filepath and write result to output_filepath
+    Audio does not get reencoded: the byte ranges of the frames to keep get copied into the output file,
+    preceded by a new Xing/Info frame.
+    """
+
+    frame_index = build_frame_index(input_filepath)
+    frame_ranges = get_keepmark_frame_ranges(keepmarks, frame_index['frame_duration'], len(frame_index['offsets']) - 1)
+    if not frame_ranges:
+        raise ValueError(f"Nothing left of {input_filepath} after cutting")
+    byte_ranges = get_frame_byte_ranges(frame_index, frame_ranges)
+
+    # Offset of n-th frame of the output, relative to start of audio
+    frame_prefix = list(itertools.accumulate((last - first for first, last in frame_ranges), initial=0))
+    byte_starts = [ start for start, end in byte_ranges ]
+    byte_prefix = list(itertools.accumulate((end - start for start, end in byte_ranges), initial=0))
+
+    def frame_offset(frame_num):
+        range_num = bisect.bisect_right(frame_prefix, frame_num) - 1
+        input_offset = frame_index['offsets'][frame_ranges[range_num][0] + frame_num - frame_prefix[range_num]]
+        byte_range_num = bisect.bisect_right(byte_starts, input_offset) - 1
+        return byte_prefix[byte_range_num] + input_offset - byte_starts[byte_range_num]
+
+    info_frame = create_info_frame(
+        frame_index['header_bytes'],
+        frame_index['vbr'],
+        frame_prefix[-1],
+        byte_prefix[-1],
+        frame_offset
+    )
+
+    with open(input_filepath, 'rb') as input_file, open(output_filepath, 'wb') as output_file:
+        output_file.write(info_frame)
+        for start, end in byte_ranges:
+            copy_file_range(input_file, output_file, start, end)
+
+
+def new_stream_cut(keepmarks):
+    """
+    Return state for cutting an MP3 stream while it gets downloaded, see stream_cut_feed()
+    """
+
+    return {
+        'keepmarks': keepmarks,
+        'buffer': bytearray(),
+        'skip': None,                           # bytes of ID3v2 tag still to skip, None: not checked yet
+        'reference': None,                      # header of first frame
+        'header_bytes': None,                   # raw header of first audio frame
+        'frame_ranges': None,                   # frame numbers to keep
+        'range_num': 0,
+        'frame_num': 0,                         # number of audio frames seen so far
+        'synced': False,                        # False: a header is only trusted if another frame follows, as in build_frame_index()
+        'vbr': False,
+        'info_size': 0,                         # size of placeholder Xing/Info frame at start of output
+        'kept_offsets': array.array('q'),       # offset of each kept frame, relative to start of audio
+        'kept_size': 0,
+    }
+
+
+def stream_cut_feed(state, data, output_file, final=False):
+    """
+    Parse MPEG audio frames from the next chunk of a downloading MP3 stream,
+    and write only frames within the keepmarks to output_file.
+    Incomplete frames are kept in state until the next chunk arrives. Set final after the last chunk.
+    """
+
+    buffer = state['buffer']
+    buffer += data
+    pos = 0
+    kept = bytearray()
+
+    while True:
+        if state['skip'] is None:
+            # Stream may start with an ID3v2 tag
+            if len(buffer) - pos < 10 and not final:
+                break
+            state['skip'] = get_id3v2_size(bytes(buffer[pos:pos+10]))
+        if state['skip']:
+            skipped = min(state['skip'], len(buffer) - pos)
+            state['skip'] -= skipped
+            pos += skipped
+            if state['skip']:
+                break
+
+        if len(buffer) - pos < 4:
+            break
+
+        header = parse_frame_header(bytes(buffer[pos:pos+4]))
+        reference = state['reference']
+        if header and reference and any(header[k] != reference[k] for k in ('version', 'layer', 'sample_rate')):
+            # Frames of a stream do not change these, must be a false sync
+            header = None
+
+        if header and not state['synced']:
+            # Resyncing: only trust header if another frame follows
+            if len(buffer) - pos < header['size'] + 4 and not final:
+                break
+            following = bytes(buffer[pos+header['size']:pos+header['size']+4])
+            if following and not parse_frame_header(following):
+                header = None
+
+        if not header:
+            # Search next frame sync
+            next_pos = buffer.find(b'\xff', pos + 1)
+            pos = next_pos if next_pos != -1 else len(buffer)
+            state['synced'] = False
+            continue
+
+        if len(buffer) - pos < header['size']:
+            # Wait for rest of frame
+            break
+
+        frame = buffer[pos:pos+header['size']]
+        pos += header['size']
+        state['synced'] = True
+
+        if reference is None:
+            state['reference'] = header
+            if parse_info_frame(frame, header) is not False:
+                # Metadata frame of original stream, not audio
+                continue
+
+        if state['header_bytes'] is None:
+            # First audio frame: now we know frame duration, and the size of the Xing/Info frame to reserve
+            state['header_bytes'] = bytes(frame[0:4])
+            state['first_bitrate'] = header['bitrate']
+            state['frame_ranges'] = get_keepmark_frame_ranges(state['keepmarks'], header['samples'] * 1000 / header['sample_rate'])
+            placeholder = create_info_frame(state['header_bytes'], False, 0, 0, None)
+            state['info_size'] = len(placeholder)
+            output_file.write(placeholder)
+        elif header['bitrate'] != state['first_bitrate']:
+            state['vbr'] = True
+
+        # Keep frame?
+        frame_ranges = state['frame_ranges']
+        while state['range_num'] < len(frame_ranges) and state['frame_num'] >= frame_ranges[state['range_num']][1]:
+            state['range_num'] += 1
+        if state['range_num'] < len(frame_ranges) and state['frame_num'] >= frame_ranges[state['range_num']][0]:
+            state['kept_offsets'].append(state['kept_size'])
+            state['kept_size'] += len(frame)
+            kept += frame
+
+        state['frame_num'] += 1
+
+    del buffer[:pos]
+    output_file.write(kept)
+
+
+def stream_cut_finish(state, output_file):
+    """
+    Complete a stream cut: write the final Xing/Info frame over the placeholder at the start of output_file
+    """
+
+    stream_cut_feed(state, b'', output_file, final=True)
+
+    if not state['kept_offsets']:
+        raise ValueError("Nothing left after cutting")
+
+    info_frame = create_info_frame(
+        state['header_bytes'],
+        state['vbr'],
+        len(state['kept_offsets']),
+        state['kept_size'],
+        lambda frame_num: state['kept_offsets'][frame_num]
+    )
+    if len(info_frame) != state['info_size']:
+        raise ValueError("Size of Xing/Info frame has changed")
+    output_file.seek(0)
+    output_file.write(info_frame)
+
+
+def download_and_cut_audio(url: str, filepath: str, keepmarks, max_attempts=4, output=sys.stdout, progress=True):
+    """
+    Download audio and cut it on the fly: only frames within keepmarks get written to filepath
+    Data is written to filepath + '.cut.part' first, so it can't be mistaken for a partial download of the whole file.
+    Failed attempts continue where they stopped with HTTP Range requests.
+    Partial data is not kept for later runs, as the cut file can not be continued.
+    Return True on success, False otherwise
+    """
+
+    chunk_size = 128*1024  # 128 kByte
+    part_filepath = filepath + '.cut.part'
+
+    state = new_stream_cut(keepmarks)
+    received = 0
+    content_length = None
+    validator = None
+
+    try:
+        with open(part_filepath, 'wb') as output_file:
+            for attempt in range(1, max_attempts+1):
+                try:
+                    headers = {}
+                    if received:
+                        headers['Range'] = f'bytes={received}-'
+                        if validator:
+                            headers['If-Range'] = validator
+
+                    with host_slot(url), http_get(url, stream=True, headers={ **headers, **AUDIO_HEADERS }) as response:
+                        response.raise_for_status()
+
+                        if received and response.status_code == 206:
+                            if int(response.headers['Content-Range'].rsplit('/', 1)[1]) != content_length:
+                                # File on server has changed, start over with next attempt
+                                received = 0
+                                raise ValueError("Size of file on server has changed")
+                        else:
+                            # Whole file, start over
+                            received = 0
+                            state = new_stream_cut(keepmarks)
+                            output_file.seek(0)
+                            output_file.truncate()
+                            content_length = int(response.headers['Content-Length'])
+                            validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            if ABORT.is_set():
+                                return False
+                            stream_cut_feed(state, chunk, output_file)
+                            received += len(chunk)
+                            count_metric('bytes', len(chunk))
+                            limit_bandwidth(url, len(chunk))
+                            if progress:
+                                print(f"\rDownloading and cutting {url} ... {received/(1024*1024):.1f}/{content_length/(1024*1024):.1f} MByte", end=" ", file=output, flush=True)
+
+                    if received != content_length:
+                        raise ValueError(f"Got {received} of {content_length} bytes")
+
+                    stream_cut_finish(state, output_file)
+                    break
+
+                except (requests.RequestException, OSError, ValueError, KeyError, IndexError):
+                    count_metric('failed_download_attempts')
+                    time.sleep(3)  # Wait 3 seconds between download attempts
+                    continue
+            else:
+                print(f"ERROR: Failed to download {url}", file=sys.stderr)
+                return False
+
+        os.replace(part_filepath, filepath)
+    finally:
+        # Never leave a cut partial behind, on failure as well as on abort
+        if os.path.exists(part_filepath):
+            os.remove(part_filepath)
+
+    # Whole file is not needed anymore, drop what earlier runs without cutting have left of it
+    discard_partial_download(filepath)
+
+    if progress:
+        print("done", file=output)
+    else:
+        print(f"Downloaded and cut {url} ({content_length/(1024*1024):.1f} MByte)", file=output)
+    return True
+
+
+@functools.lru_cache(maxsize=4096)
+def strip_html(text: str):
+    """
+    Remove HTML tags from a string
+    Results are cached, as the same texts show up in many broadcasts of a show
+    """
+
+    if text is None:
+        return None
+
+    # Add a | after <br/>
+    text = HTML_PATTERNS['br'].sub(r'\1 | ', text)
+
+    # Add a | between </p></p>
+    text = HTML_PATTERNS['paragraphs'].sub(r'\1 | \2 ', text)
+
+    # Remove tags
+    text = HTML_PATTERNS['tag'].sub('', text)
+
+    # Remove multiple consecutive spaces
+    text = HTML_PATTERNS['spaces'].sub(' ', text)
+
+    return text.strip()
+
+
+def image_key(images_list):
+    """
+    Return key identifying the image of a broadcast JSON's "images" entry, None if there's no image
+    """
+
+    if not images_list:
+        return None
+    return tuple(image_version['path'] for image_version in images_list[0]['versions'])
+
+
+@timed_stage('image')
+def get_image(images_list, max_width=None):
+    """
+    Try to download image using broadcast JSON's "images" entry
+    Without max_width get the biggest image, otherwise the biggest one not wider than max_width
+    (or the smallest one, if all are wider)
+    Return dict {'data': binary image data, 'mime': image mime type, 'description': image description, 'hash': SHA256 of data }
+    """
+
+    if not images_list:
+        return None
+
+    versions = sorted(images_list[0]['versions'], key=lambda x: x['width'], reverse=True)
+    if max_width:
+        # Fitting versions from biggest to smallest, then too wide ones from smallest to biggest
+        versions = [ v for v in versions if v['width'] <= max_width ] + [ v for v in reversed(versions) if v['width'] > max_width ]
+
+    # try versions in order of preference, biggest is usually 600px width
+    for image_version in versions:
+        try:
+            response = cached_get(image_version['path'])
+            count_metric('image_cache_hits' if response['cache'] in ('hit', 'revalidated') else 'image_cache_misses')
+            if response['status'] == 200:
+                return {
+                    'data': response['content'],
+                    'mime': response['content_type'],
+                    'description': images_list[0].get('alt') or images_list[0].get('text'),
+                    'hash': hashlib.sha256(response['content']).hexdigest(),
+                }
+        except (requests.RequestException, OSError):
+            # Try to get lower resolution image
+            continue
+    return None
+
+
+def get_images(images_lists, max_width=None, max_workers=8):
+    """
+    Download images of several "images" entries in parallel
+    Each image gets downloaded only once, no matter how many entries use it,
+    and images with identical content share the same data.
+    Return list with result of get_image() for each entry, in the same order
+    """
+
+    unique_images_lists = {}
+    for images_list in images_lists:
+        key = image_key(images_list)
+        if key is not None and key not in unique_images_lists:
+            unique_images_lists[key] = images_list
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+        downloaded = dict(zip(
+            unique_images_lists.keys(),
+            pool.map(lambda images_list: get_image(images_list, max_width), unique_images_lists.values())
+        ))
+
+    # Deduplicate by content
+    data_by_hash = {}
+    for image in downloaded.values():
+        if image:
+            image['data'] = data_by_hash.setdefault(image['hash'], image['data'])
+
+    images = []
+    for images_list in images_lists:
+        image = downloaded.get(image_key(images_list))
+        if image:
+            # Same image, but description may differ
+            image = { **image, 'description': images_list[0].get('alt') or images_list[0].get('text') }
+        images.append(image)
+    return images
+
+
+def get_genres(broadcast):
+    """
+    Retrieve list of genres from broadcast JSON's "orfcategories" entry
+    "categories" in "orfcategories" are either a string, or a key-value tuple
+    """
+
+    return [ i['categories'][-1] for i in broadcast['orfcategories'] ]
+
+
+@timed_stage('tags', profile=True)
+def set_id3_tags(filepath, chapters, keepmarks, broadcast):
+    """
+    Set id3 tags on mp3 file
+    """
+
+    from mutagen.id3 import ID3,ID3NoHeaderError,TRSN,TRSO,TPE1,TALB,TRCK,TIT2,COMM,TYER,TDAT,TIME,TLEN,CTOC,CHAP,WOAS,WORS,TCON,APIC,CTOCFlags,PictureType
+
+    # Calculate audio duration
+    broadcast_duration = sum(end-start for start, end in keepmarks)
+
+    # Create datetime object from broadcast's start time
+    broadcast_datetime = datetime.fromisoformat(broadcast['start'])
+
+    broadcast_genres = ["Radio Recording"] + get_genres(broadcast)
+
+    # Create sensible broadcast description
+    broadcast_description = "\n".join(filter(None, map(strip_html, [
+        broadcast.get('subtitle'),
+        broadcast.get('description'),
+        broadcast.get('pressRelease')
+    ])))
+    if not broadcast_description:
+        broadcast_description = broadcast_datetime.astimezone().strftime("%Y-%m-%d %H:%M")
+
+    # Remove (potentially) existing id3 tags
+    try:
+        tags = ID3(filepath)
+        tags.delete()
+    except ID3NoHeaderError:
+        tags = ID3()
+
+    # Add new id3 tags
+    tags.add(TRSN(text=[STATION_INFO['name']]))                           # Internet radio station name
+    tags.add(TRSO(text=['ORF']))                                          # Internet radio station owner
+    try:
+        tags.add(WOAS(url=broadcast['link']['url']))                      # Official audio source webpage
+    except (KeyError, TypeError):
+        pass
+    tags.add(WORS(url=STATION_INFO['website']))                           # Official Internet radio station homepage
+    tags.add(TCON(text=broadcast_genres))                                 # Content Description
+
+    tags.add(TPE1(text=[strip_html(STATION_INFO['name'])]))               # Lead performer(s)/Soloist(s) -> "FM4"
+    tags.add(TALB(text=[strip_html(broadcast['title'])]))                 # Album/Movie/Show title
+    tags.add(TRCK(text=["1/1"]))                                          # Track number/Position in set
+    tags.add(TIT2(text=[broadcast_datetime.astimezone().strftime("%Y-%m-%d %H:%M")]))   # Title/songname/content description
+
+    tags.add(COMM(lang="deu", desc="desc", text=[broadcast_description])) # Comments
+
+    tags.add(TYER(text=[broadcast_datetime.astimezone().strftime("%Y")]))              # Year of broadcast
+    tags.add(TDAT(text=[broadcast_datetime.astimezone().strftime("%d%m")]))            # Day and month of broadcast
+    tags.add(TIME(text=[broadcast_datetime.astimezone().strftime("%H%M")]))            # Time of broadcast
+
+    tags.add(TLEN(text=[int(broadcast_duration)]))                        # Duration in ms
+
+    # Download cover image, and all chapter images at once
+    image = get_image(broadcast.get('images'))
+    chapters = sorted(chapters, key=lambda x: (x['offset_start'], 1/x['offset_end']))
+    chapter_images = get_images([ chapter.get('images') for chapter in chapters ], max_width=IMAGE_SETTINGS['max_width'])
+
+    # Drop chapter images that are the same as the cover image
+    if IMAGE_SETTINGS['differing_only'] and image:
+        cover_key = image_key(broadcast.get('images'))
+        chapter_images = [
+            None if chapter_image and (image_key(chapter.get('images')) == cover_key or chapter_image['hash'] == image['hash']) else chapter_image
+            for chapter, chapter_image in zip(chapters, chapter_images)
+        ]
+
+    # Stay within size budget for images, cover image first
+    if IMAGE_SETTINGS['budget'] is not None:
+        budget = IMAGE_SETTINGS['budget']
+        if image:
+            if len(image['data']) > budget:
+                image = None
+            else:
+                budget -= len(image['data'])
+        for chapter_num, chapter_image in enumerate(chapter_images):
+            if chapter_image:
+                if len(chapter_image['data']) > budget:
+                    chapter_images[chapter_num] = None
+                else:
+                    budget -= len(chapter_image['data'])
+
+    # Add cover image
+    if image:
+        tags.add(APIC(
+            type=PictureType.COVER_FRONT,
+            desc=image['description'],
+            mime=image['mime'],
+            data=image['data']
+        ))
+
+    # Chapters
+    # ID3 forbids multiple chapters having the same start time
+    #  -> If multiple chapters start at the same time, start with the longest one and add 1ms to each following
+    previous_offset_start = -1
+    for chapter, chapter_image in zip(chapters, chapter_images):
+        sub_frames = []
+
+        chapter_title = chapter.get('title')
+        if chapter_title:
             sub_frames.append(TIT2(text=[chapter_title]))
 
-        chapter_image = get_image(chapter.get('images'))
         if chapter_image:
             sub_frames.append(APIC(
                 type=PictureType.OTHER,
@@ -524,105 +1995,1014 @@ def set_id3_tags(filepath, chapters, keepmarks, broadcast):
     tags.save(filepath, v2_version=3)
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        description = "Find all availabe recordings of a show on FM4's website, download them as MP3 files and save the shows' metadata in the ID3 tags.",
-    )
-    parser.add_argument("-c", "--cut", help='Cut all chapters of given types from recording, comma separated. Known types: B = Feature ("Beitrag"), J = Jingle, M = Music ("Musik"), N = News ("Nachrichten"), SO = Feature, W = Advertisement ("Werbung") (default: %(default)s)', default=None,  metavar='TYPE')
-    parser.add_argument("-i", "--ignore", help='Ignore recommended audio section removals. Typically News are removed/skipped this way (default: %(default)s)', action='store_true')
-    parser.add_argument("-n", "--newest", help='Download newest broadcast only (default: %(default)s)', default=False, action='store_true')
-    parser.add_argument("ShowTitle", help='The show\'s title (e.g. "Morning Show")')
-    parser.add_argument("TargetDirectory", help='Directory to save the files in (default: %(default)s)', nargs='?', default=os.getcwd())
+def get_index_path(destdir):
+    """
+    Return path of the archive index used for files in destdir
+    """
 
-    args = parser.parse_args()
+    return ARCHIVE_INDEX['filepath'] or os.path.join(destdir, ARCHIVE_INDEX['filename'])
 
-    CUT_CHAPTER_TYPES = [ x.strip().upper() for x in args.cut.split(',') ] if args.cut else []
-    IGNORE_KEEPMARKS = args.ignore
-    ONLY_NEWEST = args.newest
-    SHOW = args.ShowTitle.strip()
-    DESTDIR = args.TargetDirectory
 
-    # If PyAV is not available do not try to cut anything
-    if not PYAV_AVAILABLE and (CUT_CHAPTER_TYPES or not IGNORE_KEEPMARKS):
-        print("PyAV not found, cutting audio not supported. Will download complete broadcasts.")
-        CUT_CHAPTER_TYPES = []
-        IGNORE_KEEPMARKS = True
+def index_relpath(index_path, path):
+    """
+    Return path relative to the directory of the archive index, so the index stays valid when both get moved together
+    """
 
-    if not os.path.isdir(DESTDIR):
-        print(f"Directory {DESTDIR} does not exist!", file=sys.stderr)
-        sys.exit(1)
+    try:
+        return os.path.relpath(os.path.abspath(path), os.path.dirname(os.path.abspath(index_path)))
+    except ValueError:
+        # Different drive (Windows)
+        return os.path.abspath(path)
+
+
+def index_abspath(index_path, path):
+    """
+    Return absolute path of a path stored in the archive index
+    """
+
+    return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(index_path)), path))
+
+
+def open_index(index_path):
+    """
+    Return (shared) connection to archive index, create index if it does not exist
+    Broadcasts are recorded per target directory, so several directories can share an index (see --index).
+    Directories and file paths are stored relative to the index's directory.
+    Must be called with ARCHIVE_INDEX['lock'] held
+    """
+
+    if index_path not in ARCHIVE_INDEX['connections']:
+        connection = sqlite3.connect(index_path, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+
+        columns = [ row['name'] for row in connection.execute("PRAGMA table_info(broadcasts)") ]
+        if columns and 'directory' not in columns:
+            # Index of an older version: one entry per broadcast, with absolute file paths
+            connection.execute("ALTER TABLE broadcasts RENAME TO broadcasts_old")
+
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                broadcast_id TEXT NOT NULL,
+                directory TEXT NOT NULL,
+                title TEXT,
+                start TEXT,
+                filepath TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                cut_chapter_types TEXT NOT NULL,
+                ignore_keepmarks INTEGER NOT NULL,
+                duration INTEGER NOT NULL,
+                saved TEXT NOT NULL,
+                PRIMARY KEY (broadcast_id, directory)
+            )
+        """)
+
+        if columns and 'directory' not in columns:
+            for row in connection.execute("SELECT * FROM broadcasts_old").fetchall():
+                record = dict(row)
+                record['directory'] = index_relpath(index_path, os.path.dirname(record['filepath']))
+                record['filepath'] = index_relpath(index_path, record['filepath'])
+                connection.execute(
+                    "INSERT OR REPLACE INTO broadcasts (broadcast_id, directory, title, start, filepath, size, sha256, cut_chapter_types, ignore_keepmarks, duration, saved) "
+                    "VALUES (:broadcast_id, :directory, :title, :start, :filepath, :size, :sha256, :cut_chapter_types, :ignore_keepmarks, :duration, :saved)",
+                    record
+                )
+            connection.execute("DROP TABLE broadcasts_old")
+
+        connection.commit()
+        ARCHIVE_INDEX['connections'][index_path] = connection
+    return ARCHIVE_INDEX['connections'][index_path]
+
+
+def index_records(index_path, destdir):
+    """
+    Return list of archive index entries of all broadcasts saved in destdir, as dicts with absolute 'filepath'
+    """
+
+    with ARCHIVE_INDEX['lock']:
+        rows = open_index(index_path).execute("SELECT * FROM broadcasts WHERE directory = ?", (index_relpath(index_path, destdir),)).fetchall()
+    return [ { **dict(row), 'filepath': index_abspath(index_path, row['filepath']) } for row in rows ]
 
-    # Search for all broadcasts of show
-    all_broadcasts = get_all_broadcasts(SHOW)
 
-    if not all_broadcasts:
-        print(f"No broadcasts for '{SHOW}' found.", file=sys.stderr)
-        sys.exit()
+def index_lookup(index_path, broadcast_id, destdir):
+    """
+    Return archive index entry of a broadcast saved in destdir as dict with absolute 'filepath',
+    or None if it's not in the index
+    """
+
+    with ARCHIVE_INDEX['lock']:
+        row = open_index(index_path).execute(
+            "SELECT * FROM broadcasts WHERE broadcast_id = ? AND directory = ?",
+            (broadcast_id, index_relpath(index_path, destdir))
+        ).fetchone()
+    return { **dict(row), 'filepath': index_abspath(index_path, row['filepath']) } if row else None
+
+
+def index_store(index_path, record):
+    """
+    Add or replace a broadcast's archive index entry, the directory is the one of record's 'filepath'
+    """
+
+    record = {
+        **record,
+        'directory': index_relpath(index_path, os.path.dirname(os.path.abspath(record['filepath']))),
+        'filepath': index_relpath(index_path, record['filepath']),
+    }
+    with ARCHIVE_INDEX['lock']:
+        connection = open_index(index_path)
+        connection.execute(
+            "INSERT OR REPLACE INTO broadcasts (broadcast_id, directory, title, start, filepath, size, sha256, cut_chapter_types, ignore_keepmarks, duration, saved) "
+            "VALUES (:broadcast_id, :directory, :title, :start, :filepath, :size, :sha256, :cut_chapter_types, :ignore_keepmarks, :duration, :saved)",
+            record
+        )
+        connection.commit()
+
+
+def get_broadcast_id(broadcast):
+    """
+    Return ORF's id of a broadcast, from full broadcast data or search result
+    """
+
+    return str(broadcast.get('id') or broadcast['href'])
+
+
+def file_sha256(filepath):
+    """
+    Return SHA256 hex digest of a file's content
+    """
+
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024*1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+@timed_stage('verify')
+def verify_audio(filepath, expected_duration=None, expected_size=None, expected_sha256=None):
+    """
+    Check integrity of an MP3 file:
+        size and SHA256 checksum, if expected ones are given (from the archive index)
+        MPEG frames: each frame must follow its predecessor, and the last one should be complete
+        number of frames against the Xing/Info header
+        duration against expected_duration in ms (default: the file's TLEN tag), too short means truncated
+    Return tuple (list of errors, list of warnings)
+    """
+
+    errors = []
+    warnings = []
+
+    size = os.path.getsize(filepath)
+    if expected_size is not None and size != expected_size:
+        errors.append(f"Size is {size} bytes, but {expected_size} bytes were saved")
+    elif expected_sha256 and file_sha256(filepath) != expected_sha256:
+        errors.append("Content has changed since it was saved (SHA256 checksum differs)")
+
+    try:
+        frame_index = build_frame_index(filepath)
+    except ValueError as e:
+        errors.append(str(e))
+        return errors, warnings
+
+    num_frames = len(frame_index['offsets']) - 1
+    duration = num_frames * frame_index['frame_duration']
+
+    if frame_index['gaps']:
+        warnings.append(f"{len(frame_index['gaps'])} corrupt section(s) between MPEG frames")
+
+    # Only an ID3v1 tag (128 bytes) may follow the last frame.
+    # More is an incomplete last frame or garbage, which players skip. Truncated files are too short or have the wrong size.
+    trailing = size - frame_index['offsets'][-1]
+    if trailing > 128:
+        warnings.append(f"{trailing} bytes of garbage or incomplete frame after last MPEG frame")
 
-    if ONLY_NEWEST:
-        all_broadcasts = [ all_broadcasts[0] ]
+    if frame_index['declared_frames'] is not None and frame_index['declared_frames'] != num_frames:
+        errors.append(f"Xing/Info header announces {frame_index['declared_frames']} frames, but there are {num_frames}")
 
-    # Process all matching broadcasts
-    for broadcast in all_broadcasts:
+    if expected_duration is None:
+        from mutagen.id3 import ID3, ID3NoHeaderError
+        try:
+            tlen = ID3(filepath).get('TLEN')
+            expected_duration = int(tlen.text[0]) if tlen else None
+        except (ID3NoHeaderError, ValueError):
+            expected_duration = None
+    if expected_duration:
+        tolerance = max(VERIFY_SETTINGS['tolerance'], expected_duration * VERIFY_SETTINGS['tolerance_share'])
+        if duration < expected_duration - tolerance:
+            errors.append(f"Audio is {duration/1000:.0f} seconds long, but should be {expected_duration/1000:.0f} seconds")
+        elif duration > expected_duration + tolerance:
+            warnings.append(f"Audio is {duration/1000:.0f} seconds long, but should be {expected_duration/1000:.0f} seconds")
+
+    return errors, warnings
+
+
+def prepare_broadcast(broadcast, filepath, cut_chapter_types, ignore_keepmarks, output=sys.stdout):
+    """
+    Work out chapters, keepmarks and audio URL of a broadcast
+    Return dict describing the job
+    """
+
+    broadcast_duration = broadcast['duration']
+
+    # Get chapters
+    chapters = get_chapters(broadcast)
+
+    # Get markers with recommended audio sections to keep
+    if ignore_keepmarks:
+        keepmarks = [ [0, broadcast_duration] ]
+    else:
+        keepmarks = get_keepmarks(broadcast)
+
+    # Remove unwanted chapters from keepmarks and from list of chapters
+    if cut_chapter_types:
+        keepmarks = remove_chaptertypes_from_keepmarks(
+            keepmarks,
+            chapters,
+            cut_chapter_types)
+        chapters = [ c for c in chapters if c['type'] not in cut_chapter_types ]
+
+    # Realign chapters with keepmarks unless there's only a single keepmark spanning the whole broadcast
+    if not keepmarks == [ [0, broadcast['duration']] ]:
+        chapters = align_chapters_to_keepmarks(chapters, keepmarks)
+
+    # Note: Downloading only the required audio parts (and merging them)
+    #       works, but ORF's server does not deliver perfectly cut parts
+    #       leading to inaccurate chapter marks, and sometimes even hang during downloads.
+    #       So let's download the whole brodcast and remove the parts
+    #       that are not needed afterwards.
+    url = re.sub(r'{.*$', '', broadcast['streams'][0]['uriTemplates']['progressive'])
+
+    return {
+        'broadcast': broadcast,
+        'filepath': filepath,
+        'chapters': chapters,
+        'keepmarks': keepmarks,
+        'url': url,
+        'output': output,
+    }
+
+
+def get_jobs(search_results, destdir, cut_chapter_types, ignore_keepmarks, buffered=False, keep_original=False, stream_cut=False, broadcast_ttl=None):
+    """
+    Generator yielding a job for each search result
+    Broadcasts listed in the archive index with an intact file, or (if not indexed) whose file already exists,
+    are skipped before their full JSON gets downloaded, so only broadcasts that will actually be processed cost a request.
+    If buffered is True, each job's output is collected in a buffer instead of being printed.
+    If keep_original is True, the uncut download and the broadcast JSON are kept for re-cutting later on.
+    If stream_cut is True, audio gets cut while downloading (not together with keep_original).
+    Broadcasts without published audio yet are skipped, their skip jobs are marked 'pending'.
+    The JSON of all broadcasts to process is downloaded in parallel, with up to HTTP_SETTINGS['parallel_requests'] requests at a time.
+    """
 
-        broadcast_duration = broadcast['duration']
+    index_path = get_index_path(destdir)
 
+    # Find out which broadcasts to skip, no network needed
+    entries = []
+    for search_result in search_results:
         # Create final filename
-        filepath = os.path.join(DESTDIR, create_filename(broadcast))
+        filepath = os.path.join(destdir, create_filename(search_result))
+
+        broadcast_id = get_broadcast_id(search_result)
+        skip_filepath = None
+        message = None
+        record = index_lookup(index_path, broadcast_id, destdir)
+        if record:
+            if not os.path.isfile(record['filepath']) and os.path.isfile(filepath):
+                # Not where it was recorded (e.g. shared index and directory got moved), but where it would be saved now
+                record['filepath'] = filepath
+            # Skip this broadcast if its file is still there and complete
+            try:
+                intact = os.path.getsize(record['filepath']) == record['size']
+            except OSError:
+                intact = False
+            if intact:
+                skip_filepath = record['filepath']
+                message = f"{record['filepath']} already exists, skipping."
+            else:
+                message = f"{record['filepath']} is missing or incomplete, downloading again."
+
+        # Skip this broadcast if file already exists (downloaded before there was an index)
+        elif os.path.isfile(filepath) and os.path.getsize(filepath)>0:
+            skip_filepath = filepath
+            message = f"{filepath} already exists, skipping."
+
+        entries.append((search_result, filepath, broadcast_id, skip_filepath, message))
+
+    pool = concurrent.futures.ThreadPoolExecutor(HTTP_SETTINGS['parallel_requests'])
+    try:
+        broadcast_futures = [ pool.submit(get_broadcast, search_result, broadcast_ttl) if not skip_filepath else None
+                              for search_result, filepath, broadcast_id, skip_filepath, message in entries ]
+    finally:
+        pool.shutdown(wait=False)
+
+    for (search_result, filepath, broadcast_id, skip_filepath, message), broadcast_future in zip(entries, broadcast_futures):
+        output = io.StringIO() if buffered else sys.stdout
+
+        if message:
+            print(message, file=output, flush=True)
+        if skip_filepath:
+            yield { 'skip': True, 'filepath': skip_filepath, 'output': output }
+            continue
 
-        # Skip this broadcast if file already exists
-        if os.path.isfile(filepath) and os.path.getsize(filepath)>0:
-            print(f"{filepath} already exists, skipping.", flush=True)
+        try:
+            broadcast = broadcast_future.result()
+        except BaseException:
+            # Do not wait for the remaining downloads
+            for future in broadcast_futures:
+                if future:
+                    future.cancel()
+            raise
+        if not broadcast.get('streams'):
+            print(f"Audio of {filepath} is not available yet, skipping.", file=output, flush=True)
+            yield { 'skip': True, 'pending': True, 'filepath': filepath, 'output': output }
             continue
 
-        # Get chapters
-        chapters = get_chapters(broadcast)
+        job = prepare_broadcast(broadcast, filepath, cut_chapter_types, ignore_keepmarks, output=output)
+        job.update({
+            'broadcast_id': broadcast_id,
+            'index': index_path,
+            'cut_chapter_types': cut_chapter_types,
+            'ignore_keepmarks': ignore_keepmarks,
+            'keep_original': keep_original,
+            'stream_cut': stream_cut and not keep_original and job['keepmarks'] != [ [0, broadcast['duration']] ],
+        })
+        yield job
 
-        # Get markers with recommended audio sections to keep
-        if IGNORE_KEEPMARKS:
-            keepmarks = [ [0, broadcast_duration] ]
+
+def get_recut_jobs(destdir, cut_chapter_types, ignore_keepmarks, buffered=False):
+    """
+    Generator yielding a job for each original audio file kept in destdir, to cut and tag it again
+    Uses only the kept broadcast JSON and audio file (and cached images), no network
+    """
+
+    index_path = get_index_path(destdir)
+
+    for json_filepath in sorted(glob.glob(os.path.join(glob.escape(destdir), ORIGINALS_DIRECTORY, '*.json'))):
+        output = io.StringIO() if buffered else sys.stdout
+
+        original_filepath = os.path.splitext(json_filepath)[0] + '.mp3'
+        if not os.path.isfile(original_filepath):
+            print(f"WARNING: {original_filepath} is missing, cannot re-cut", file=sys.stderr)
+            continue
+
+        with open(json_filepath, 'r') as json_file:
+            broadcast = json.load(json_file)
+
+        filepath = os.path.join(destdir, os.path.basename(original_filepath))
+        job = prepare_broadcast(broadcast, filepath, cut_chapter_types, ignore_keepmarks, output=output)
+        job.update({
+            'source': original_filepath,
+            'keep_source': True,
+            'broadcast_id': get_broadcast_id(broadcast),
+            'index': index_path,
+            'cut_chapter_types': cut_chapter_types,
+            'ignore_keepmarks': ignore_keepmarks,
+        })
+        yield job
+
+
+def verify_file(filepath, record=None):
+    """
+    Verify a file of the archive against its archive index entry record, for verify_archive()
+    Return tuple (filepath, list of errors, list of warnings)
+    """
+
+    try:
+        if record:
+            errors, warnings = verify_audio(filepath, expected_duration=record['duration'], expected_size=record['size'], expected_sha256=record['sha256'])
         else:
-            keepmarks = get_keepmarks(broadcast)
-
-        # Remove unwanted chapters from keepmarks and from list of chapters
-        if CUT_CHAPTER_TYPES:
-            keepmarks = remove_chaptertypes_from_keepmarks(
-                keepmarks,
-                chapters,
-                CUT_CHAPTER_TYPES)
-            chapters = [ c for c in chapters if c['type'] not in CUT_CHAPTER_TYPES ]
-
-        # Realign chapters with keepmarks unless there's only a single keepmark spanning the whole broadcast
-        if not keepmarks == [ [0, broadcast['duration']] ]:
-            chapters = align_chapters_to_keepmarks(chapters, keepmarks)
-
-        # Download broadcast's audio
-        # Note: Downloading only the required audio parts (and merging them)
-        #       works, but ORF's server does not deliver perfectly cut parts
-        #       leading to inaccurate chapter marks, and sometimes even hang during downloads.
-        #       So let's download the whole brodcast and remove the parts
-        #       that are not needed afterwards.
-        url = re.sub(r'{.*$', '', broadcast['streams'][0]['uriTemplates']['progressive'])
-        broadcast_audio = download_audio(url)
-        if not broadcast_audio:
-            # Download failed. Try next broadcast
+            errors, warnings = verify_audio(filepath)
+    except OSError as e:
+        errors, warnings = [ str(e) ], []
+    return filepath, errors, warnings
+
+
+def get_unindexed_record(filepath, cut_chapter_types, ignore_keepmarks):
+    """
+    Make up an archive index entry for a file saved before there was an index, so verify_archive() can download it again
+    Airdate is taken from the file's name (see create_filename()), show title from its ID3 tags or else from its name.
+    Broadcast id is not known, it's None.
+    Return dict like index_lookup(), or None if the name does not contain an airdate
+    """
+
+    name = os.path.splitext(os.path.basename(filepath))[0]
+    airdate = re.search(r'\s(\d{4}-\d{2}-\d{2} \d{2}_\d{2})$', name)
+    if not airdate:
+        return None
+
+    from mutagen.id3 import ID3, ID3NoHeaderError
+    try:
+        title = ID3(filepath).get('TALB')
+        title = title.text[0] if title else None
+    except (ID3NoHeaderError, ValueError, OSError):
+        title = None
+    if not title:
+        title = clean_show_title(name[:airdate.start()].replace('_', ' '))
+
+    return {
+        'broadcast_id': None,
+        'title': title,
+        'start': datetime.strptime(airdate.group(1), "%Y-%m-%d %H_%M").astimezone().isoformat(),
+        'filepath': os.path.abspath(filepath),
+        'cut_chapter_types': ','.join(cut_chapter_types),
+        'ignore_keepmarks': int(ignore_keepmarks),
+        'saved': None,
+    }
+
+
+def verify_archive(destdir, num_workers, cut_chapter_types=(), ignore_keepmarks=False):
+    """
+    Verify all MP3 files in destdir and all files listed in its archive index, num_workers files at a time
+    Files are checked in separate processes, as walking through MPEG frames is CPU bound.
+    Broken or missing files of broadcasts FM4 still has get downloaded again. While that happens broken files are kept as *.broken,
+    they get their name back if the download fails.
+    Files not in the archive index are found by their name, and cut with cut_chapter_types and ignore_keepmarks.
+    Return number of broken or missing files that could not be repaired
+    """
+
+    index_path = get_index_path(destdir)
+    records = { record['filepath']: record for record in index_records(index_path, destdir) }
+
+    filepaths = sorted(glob.glob(os.path.join(glob.escape(destdir), '*.mp3')))
+    broken = []
+
+    for filepath, record in records.items():
+        if not os.path.isfile(filepath):
+            print(f"MISSING: {filepath}", flush=True)
+            broken.append((filepath, record))
+
+    with concurrent.futures.ProcessPoolExecutor(num_workers) as pool:
+        results = pool.map(verify_file, filepaths, [ records.get(os.path.abspath(filepath)) for filepath in filepaths ])
+        for filepath, errors, warnings in results:
+            for warning in warnings:
+                print(f"WARNING: {filepath}: {warning}", flush=True)
+            if errors:
+                print(f"BROKEN: {filepath}: {'; '.join(errors)}", flush=True)
+                broken.append((filepath, records.get(os.path.abspath(filepath))))
+            elif not warnings:
+                print(f"OK: {filepath}", flush=True)
+
+    print(f"Verified {len(filepaths)} files, {len(broken)} broken or missing.", flush=True)
+
+    # Download broken broadcasts again, as long as FM4 still has them
+    oldest_available = datetime.now().timestamp() - VERIFY_SETTINGS['available_days'] * 24 * 3600
+    repairable = []
+    unrepaired = 0
+    for filepath, record in broken:
+        if not record:
+            record = get_unindexed_record(filepath, cut_chapter_types, ignore_keepmarks)
+        if not record:
+            print(f"ERROR: {filepath} cannot be downloaded again, it is not in the archive index and its name has no airdate", file=sys.stderr)
+            unrepaired += 1
+            continue
+        if datetime.fromisoformat(record['start']).timestamp() < oldest_available:
+            print(f"ERROR: {filepath} cannot be downloaded again, it is no longer available", file=sys.stderr)
+            unrepaired += 1
             continue
+        repairable.append((filepath, record))
+
+    if repairable:
+        try:
+            search_results = search_shows(sorted({ record['title'] for filepath, record in repairable }))
+            jobs = []
+            for filepath, record in repairable:
+                if record['broadcast_id'] is None:
+                    # Not indexed, find broadcast that would be saved under this name
+                    matching = [ search_result for search_result in search_results[record['title']] if create_filename(search_result) == os.path.basename(filepath) ]
+                else:
+                    matching = [ search_result for search_result in search_results[record['title']] if get_broadcast_id(search_result) == record['broadcast_id'] ]
+                if not matching:
+                    print(f"ERROR: {filepath} cannot be downloaded again, it was not found", file=sys.stderr)
+                    continue
+                record['broadcast_id'] = get_broadcast_id(matching[0])
+                if os.path.isfile(filepath):
+                    # Keep broken file out of the way until the new download succeeded
+                    os.replace(filepath, filepath + '.broken')
+                cut_chapter_types = [ x for x in record['cut_chapter_types'].split(',') if x ]
+                jobs += get_jobs(matching, destdir, cut_chapter_types, bool(record['ignore_keepmarks']), buffered=num_workers > 1)
+            process_jobs(jobs, num_workers)
+
+        finally:
+            for filepath, record in repairable:
+                new_record = index_lookup(index_path, record['broadcast_id'], destdir) if record['broadcast_id'] else None
+                if new_record and new_record['saved'] != record['saved'] and os.path.isfile(new_record['filepath']):
+                    if os.path.isfile(filepath + '.broken'):
+                        os.remove(filepath + '.broken')
+                else:
+                    unrepaired += 1
+                    if os.path.isfile(filepath + '.broken') and not os.path.exists(filepath):
+                        # Repair failed, broken file gets its name back
+                        os.replace(filepath + '.broken', filepath)
+
+    return unrepaired
+
+
+def run_recut_jobs(jobs, num_workers):
+    """
+    Cut and tag jobs with num_workers threads
+    Output of each job is buffered and printed in the order of jobs.
+    """
+
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as pool:
+        submitted = [ (job, pool.submit(finish_broadcast, job)) for job in jobs ]
+        for job, future in submitted:
+            error = future.exception()
+            print(job['output'].getvalue(), end='', flush=True)
+            if error:
+                print(f"ERROR: Failed to process {job['filepath']}: {error}", file=sys.stderr)
+
+
+@timed_stage('download')
+def download_broadcast(job, progress=True, segments=1):
+    """
+    Download broadcast's audio (network bound part of a job)
+    Return True on success
+    """
+
+    if job.get('stream_cut'):
+        return download_and_cut_audio(job['url'], job['filepath'] + '.download', job['keepmarks'], output=job['output'], progress=progress)
+
+    return download_audio(job['url'], job['filepath'] + '.download', output=job['output'], progress=progress, segments=segments)
+
+
+def get_original_filepath(filepath, extension='.mp3'):
+    """
+    Return path of original, uncut audio file (or with extension '.json': of broadcast JSON) kept for filepath
+    """
+
+    return os.path.join(os.path.dirname(filepath), ORIGINALS_DIRECTORY, os.path.splitext(os.path.basename(filepath))[0] + extension)
 
-        # Cut audio data with PyAV unless there's only one keepmark, spanning whole broadcast
-        if keepmarks != [ [0, broadcast_duration] ]:
-            broadcast_audio = cut_audio(broadcast_audio, keepmarks)
 
-        # Save audio data to file
-        with open(filepath + '.temp', 'wb') as output_file:
-            output_file.write(broadcast_audio)
+def keep_original(source_filepath, filepath, broadcast):
+    """
+    Move original, uncut audio file to the originals directory next to filepath and save broadcast JSON along with it
+    Return path of original audio file
+    """
 
-        # Set id3 tags
-        set_id3_tags(filepath + '.temp', chapters, keepmarks, broadcast)
+    original_filepath = get_original_filepath(filepath)
+    os.makedirs(os.path.dirname(original_filepath), exist_ok=True)
 
-        # Rename temporary mp3 file to final filename
-        os.rename(filepath + '.temp', filepath)
+    with open(get_original_filepath(filepath, '.json.temp'), 'w') as json_file:
+        json.dump(broadcast, json_file)
+    os.replace(get_original_filepath(filepath, '.json.temp'), get_original_filepath(filepath, '.json'))
+    os.replace(source_filepath, original_filepath)
 
-        print(f"Saved as {filepath}")
+    return original_filepath
+
+
+def finish_broadcast(job):
+    """
+    Cut audio, set ID3 tags and move file to its final name (CPU bound part of a job)
+    Audio is taken from job's 'source' (default: the download), which gets removed afterwards unless 'keep_source' is set.
+    """
+
+    filepath = job['filepath']
+    keepmarks = job['keepmarks']
+    broadcast = job['broadcast']
+
+    source = job.get('source', filepath + '.download')
+    keep_source = job.get('keep_source', False)
+    if job.get('keep_original'):
+        source = keep_original(source, filepath, broadcast)
+        keep_source = True
+
+    # Cut audio file unless there's only one keepmark, spanning whole broadcast, or it got cut while downloading
+    cut = not job.get('stream_cut') and keepmarks != [ [0, broadcast['duration']] ]
+    if cut:
+        cut_audio(source, filepath + '.temp', keepmarks)
+
+    # Check audio before the download gets removed or anything gets replaced
+    errors, warnings = verify_audio(filepath + '.temp' if cut else source, expected_duration=sum(end - start for start, end in keepmarks))
+    for warning in warnings:
+        print(f"WARNING: {filepath}: {warning}", file=job['output'])
+    if errors:
+        if cut:
+            os.remove(filepath + '.temp')
+        # Keep download for inspection
+        raise ValueError(f"{filepath} is broken: {'; '.join(errors)} (audio kept as {source})")
+
+    if cut:
+        if not keep_source:
+            os.remove(source)
+    elif keep_source:
+        shutil.copyfile(source, filepath + '.temp')
+    else:
+        os.rename(source, filepath + '.temp')
+
+    # Set id3 tags
+    set_id3_tags(filepath + '.temp', job['chapters'], keepmarks, broadcast)
+
+    # Rename temporary mp3 file to final filename
+    os.replace(filepath + '.temp', filepath)
+
+    # Add file to archive index
+    if job.get('index'):
+        index_store(job['index'], {
+            'broadcast_id': job['broadcast_id'],
+            'title': strip_html(broadcast['title']),
+            'start': broadcast['start'],
+            'filepath': os.path.abspath(filepath),
+            'size': os.path.getsize(filepath),
+            'sha256': file_sha256(filepath),
+            'cut_chapter_types': ','.join(job['cut_chapter_types']),
+            'ignore_keepmarks': int(job['ignore_keepmarks']),
+            'duration': int(sum(end - start for start, end in keepmarks)),
+            'saved': datetime.now().astimezone().isoformat(),
+        })
+
+    print(f"Saved as {filepath}", file=job['output'])
+
+
+def run_jobs(jobs, num_workers, segments=1):
+    """
+    Process jobs with num_workers parallel downloads, while cutting and tagging of finished downloads is done
+    by a separate pool of num_workers threads.
+    Output of each job is buffered and printed in the order of jobs.
+    """
+
+    def chain(result, job, download_future):
+        # Hand job over from download pool to processing pool
+        try:
+            if not download_future.result():
+                result.set_result(None)
+                return
+            process_future = process_pool.submit(finish_broadcast, job)
+        except Exception as e:
+            result.set_exception(e)
+            return
+        process_future.add_done_callback(lambda f: result.set_exception(f.exception()) if f.exception() else result.set_result(None))
+
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as download_pool, \
+         concurrent.futures.ThreadPoolExecutor(num_workers) as process_pool:
+        submitted_jobs = []
+        results = []
+        for job in jobs:
+            submitted_jobs.append(job)
+            result = concurrent.futures.Future()
+            if job.get('skip'):
+                result.set_result(None)
+            else:
+                download_future = download_pool.submit(download_broadcast, job, False, segments)
+                download_future.add_done_callback(lambda f, result=result, job=job: chain(result, job, f))
+            results.append(result)
+
+        try:
+            for job, result in zip(submitted_jobs, results):
+                error = result.exception()
+                print(job['output'].getvalue(), end='', flush=True)
+                if error:
+                    print(f"ERROR: Failed to process {job['filepath']}: {error}", file=sys.stderr)
+        except BaseException:
+            # Interrupted: drop queued jobs, running downloads stop on their own
+            download_pool.shutdown(cancel_futures=True)
+            raise
+
+
+def load_shows_config(filepath):
+    """
+    Read list of shows from a TOML or JSON config file:
+        [[shows]]
+        title = "Morning Show"
+        directory = "/srv/fm4/Morning Show"   # optional, default: current directory
+        cut = "N,W"                           # optional, same as --cut
+        ignore = false                        # optional, same as --ignore
+        newest = false                        # optional, same as --newest
+        keep_original = false                 # optional, same as --keep-original
+    JSON files contain the same structure: {"shows": [{"title": "Morning Show", ...}, ...]}
+    Return list of dicts with each show's settings
+    """
+
+    if filepath.lower().endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            raise ValueError("Reading TOML files requires Python 3.11 or newer, use a JSON file instead")
+        with open(filepath, 'rb') as config_file:
+            config = tomllib.load(config_file)
+    else:
+        with open(filepath, 'r') as config_file:
+            config = json.load(config_file)
+
+    shows = []
+    for entry in config.get('shows', []):
+        cut = entry.get('cut') or []
+        if isinstance(cut, str):
+            cut = cut.split(',')
+        shows.append({
+            'title': entry['title'].strip(),
+            'directory': entry.get('directory', os.getcwd()),
+            'cut_chapter_types': [ x.strip().upper() for x in cut ],
+            'ignore_keepmarks': bool(entry.get('ignore', False)),
+            'only_newest': bool(entry.get('newest', False)),
+            'keep_original': bool(entry.get('keep_original', False)),
+        })
+    return shows
+
+
+def get_show_jobs(show, buffered=False, search_results=None):
+    """
+    Generator yielding a job for each broadcast of a show
+    search_results are the show's results of search_shows(), the show gets searched if they are not given
+    """
+
+    if search_results is None:
+        search_results = search_broadcasts(show['title'])
+
+    if not search_results:
+        print(f"No broadcasts for '{show['title']}' found.", file=sys.stderr)
+        return
+
+    if show['only_newest']:
+        search_results = [ search_results[0] ]
+
+    yield from get_jobs(search_results, show['directory'], show['cut_chapter_types'], show['ignore_keepmarks'], buffered=buffered, keep_original=show['keep_original'], stream_cut=STREAM_CUT['enabled'])
+
+
+def process_jobs(jobs, num_workers, segments=1):
+    """
+    Download, cut and tag all jobs, one after another or with num_workers in parallel
+    A failed job does not stop the remaining ones.
+    """
+
+    if num_workers == 1:
+        for job in jobs:
+            if job.get('skip'):
+                continue
+            try:
+                if download_broadcast(job, segments=segments):
+                    finish_broadcast(job)
+            except Exception as e:
+                print(f"ERROR: Failed to process {job['filepath']}: {e}", file=sys.stderr)
+    else:
+        run_jobs(jobs, num_workers, segments=segments)
+
+
+def schedule_broadcasts(shows, schedule, scheduled, first=False):
+    """
+    Search broadcasts of all shows and add the ones not seen before to schedule,
+    a heap of [due time, sequence number, show, search result, attempt] entries
+    A broadcast is due WATCH_SETTINGS['delay'] seconds after its end.
+    scheduled is the set of (directory, broadcast id) already in the schedule or done. On the first search,
+    only the newest ended broadcast of shows with only_newest is scheduled.
+    """
+
+    SEARCH_RESULTS.clear()
+    search_results = search_shows([ show['title'] for show in shows ], include_upcoming=True)
+    now = time.time()
+    listed = set()
+    for show in shows:
+        ended = 0
+        for search_result in search_results[show['title']]:
+            key = (show['directory'], get_broadcast_id(search_result))
+            listed.add(key)
+            if key in scheduled:
+                continue
+            end = datetime.fromisoformat(search_result['end']).timestamp()
+            if end <= now:
+                ended += 1
+                if first and show['only_newest'] and ended > 1:
+                    continue
+            scheduled.add(key)
+            heapq.heappush(schedule, [ end + WATCH_SETTINGS['delay'], next(WATCH_SEQUENCE), show, search_result, 0 ])
+
+    # Forget broadcasts that are no longer available
+    scheduled.intersection_update(listed | { (entry[2]['directory'], get_broadcast_id(entry[3])) for entry in schedule })
+
+
+def watch(shows, num_workers, segments=1, priority=None):
+    """
+    Run until interrupted: sleep until broadcasts have ended and download each one as soon as it is due
+    Broadcasts whose audio is not published yet, or whose download failed, are retried with growing delays.
+    Broadcasts due at the same time are downloaded in order of priority (see sort_by_priority()).
+    """
+
+    schedule = []
+    scheduled = set()
+    next_search = 0
+    first = True
+
+    while not ABORT.is_set():
+        now = time.time()
+        if now >= next_search:
+            try:
+                schedule_broadcasts(shows, schedule, scheduled, first=first)
+                first = False
+                next_search = now + WATCH_SETTINGS['refresh']
+            except (requests.RequestException, ValueError, KeyError) as e:
+                print(f"WARNING: Search for broadcasts failed: {e}", file=sys.stderr)
+                next_search = now + WATCH_SETTINGS['backoff_min']
+
+        due = []
+        while schedule and schedule[0][0] <= now:
+            due.append(heapq.heappop(schedule))
+
+        if not due:
+            wake = min(next_search, schedule[0][0]) if schedule else next_search
+            print(f"Waiting until {datetime.fromtimestamp(wake).strftime('%Y-%m-%d %H:%M:%S')} ...", flush=True)
+            ABORT.wait(max(0, wake - now))
+            continue
+
+        jobs = []
+        for entry in sort_by_priority(due, priority, lambda entry: entry[3]):
+            due_time, sequence, show, search_result, attempt = entry
+            try:
+                job = next(get_jobs([ search_result ], show['directory'], show['cut_chapter_types'], show['ignore_keepmarks'], buffered=True, keep_original=show['keep_original'], stream_cut=STREAM_CUT['enabled'], broadcast_ttl=0))
+            except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+                print(f"WARNING: Could not get broadcast {search_result['href']}: {e}", file=sys.stderr)
+                job = { 'skip': True, 'pending': True, 'filepath': None, 'output': io.StringIO() }
+            jobs.append((entry, job))
+
+        # Errors of single jobs must not end watch mode, so always use run_jobs()
+        run_jobs([ job for entry, job in jobs ], num_workers, segments=segments)
+        if METRICS['filepath']:
+            write_metrics(METRICS['filepath'])
+
+        # Retry broadcasts that are not available yet or failed, with exponential backoff
+        for entry, job in jobs:
+            if job.get('skip') and not job.get('pending'):
+                continue
+            if not job.get('skip') and index_lookup(job['index'], job['broadcast_id'], entry[2]['directory']):
+                continue
+            entry[4] += 1
+            if entry[4] >= WATCH_SETTINGS['max_attempts']:
+                print(f"ERROR: Giving up on broadcast {entry[3]['href']} after {entry[4]} attempts", file=sys.stderr)
+                continue
+            entry[0] = time.time() + min(WATCH_SETTINGS['backoff_min'] * 2**(entry[4]-1), WATCH_SETTINGS['backoff_max'])
+            heapq.heappush(schedule, entry)
+
+
+def get_prioritized_jobs(shows, search_results, priority, buffered=False):
+    """
+    Generator yielding a job for each broadcast of all shows, ordered by priority across all shows (see sort_by_priority())
+    search_results are the results of search_shows()
+    """
+
+    entries = []
+    for show in shows:
+        show_results = search_results[show['title']]
+        if not show_results:
+            yield from get_show_jobs(show, buffered=buffered, search_results=show_results)
+        elif show['only_newest']:
+            show_results = show_results[:1]
+        entries += [ (show, search_result) for search_result in show_results ]
+
+    entries = sort_by_priority(entries, priority, lambda entry: entry[1])
+
+    # Consecutive broadcasts of the same show share one get_jobs(), so their data gets downloaded in parallel
+    for show_id, group in itertools.groupby(entries, key=lambda entry: id(entry[0])):
+        group = list(group)
+        yield from get_show_jobs(group[0][0], buffered=buffered, search_results=[ search_result for show, search_result in group ])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = "Find all availabe recordings of a show on FM4's website, download them as MP3 files and save the shows' metadata in the ID3 tags.",
+    )
+    parser.add_argument("-c", "--cut", help='Cut all chapters of given types from recording, comma separated. Known types: B = Feature ("Beitrag"), J = Jingle, M = Music ("Musik"), N = News ("Nachrichten"), SO = Feature, W = Advertisement ("Werbung") (default: %(default)s)', default=None,  metavar='TYPE')
+    parser.add_argument("-i", "--ignore", help='Ignore recommended audio section removals. Typically News are removed/skipped this way (default: %(default)s)', action='store_true')
+    parser.add_argument("-n", "--newest", help='Download newest broadcast only (default: %(default)s)', default=False, action='store_true')
+    parser.add_argument("-j", "--jobs", help='Number of broadcasts to download and process in parallel (default: %(default)s)', type=int, default=1, metavar='N')
+    parser.add_argument("-s", "--segments", help='Download each broadcast in N parallel byte ranges, if the server supports this (default: %(default)s)', type=int, default=1, metavar='N')
+    parser.add_argument("--max-per-host", help='Maximum number of parallel downloads from the same host (default: %(default)s)', type=int, default=HOST_SLOTS['max_per_host'], metavar='N')
+    parser.add_argument("--timeout", help='Network timeout in seconds (default: %(default)s)', type=float, default=HTTP_SETTINGS['timeout'], metavar='SECONDS')
+    parser.add_argument("--retries", help='Number of retries of failed requests, with exponential backoff (default: %(default)s)', type=int, default=HTTP_SETTINGS['retries'], metavar='N')
+    parser.add_argument("--no-compression", help='Do not ask server for compressed responses (default: %(default)s)', default=False, action='store_true')
+    parser.add_argument("--cache-dir", help='Directory to cache broadcast data and images in (default: %(default)s)', default=CACHE_SETTINGS['directory'], metavar='DIR')
+    parser.add_argument("--cache-ttl", help='Seconds until cached data gets revalidated with the server (default: %(default)s)', type=int, default=CACHE_SETTINGS['ttl'], metavar='SECONDS')
+    parser.add_argument("--cache-size", help='Maximum size of cache in MByte (default: %(default)s)', type=int, default=CACHE_SETTINGS['max_size']//(1024*1024), metavar='MBYTE')
+    parser.add_argument("--no-cache", help='Do not cache broadcast data and images (default: %(default)s)', default=False, action='store_true')
+    parser.add_argument("--max-image-width", help='Maximum width of chapter images in pixels, uses the biggest fitting image FM4 provides (default: %(default)s)', type=int, default=None, metavar='PX')
+    parser.add_argument("--image-budget", help='Maximum total size of all images in a file in kByte, cover image first (default: %(default)s)', type=int, default=None, metavar='KBYTE')
+    parser.add_argument("--differing-chapter-images", help='Only add chapter images that differ from the cover image (default: %(default)s)', default=False, action='store_true')
+    parser.add_argument("--index", help=f'Archive index (SQLite database) of downloaded broadcasts (default: {ARCHIVE_INDEX["filename"]} in each target directory)', default=None, metavar='FILE')
+    parser.add_argument("--cut-while-downloading", help='Cut audio while it gets downloaded, saves a second pass over the file. Not combinable with --segments and --keep-original, interrupted downloads are not continued by later runs (default: %(default)s)', default=False, action='store_true')
+    parser.add_argument("--keep-original", help=f'Keep uncut audio and broadcast data in "{ORIGINALS_DIRECTORY}" in target directory, for --recut (default: %(default)s)', default=False, action='store_true')
+    parser.add_argument("--recut", help='Cut and tag all broadcasts kept with --keep-original in DIR again, using --cut and --ignore. Does not download anything (default: %(default)s)', default=None, metavar='DIR')
+    parser.add_argument("--rate-limit", help='Maximum bandwidth of all downloads together in kByte/s (default: %(default)s)', type=int, default=None, metavar='KBYTE')
+    parser.add_argument("--host-rate-limit", help='Maximum bandwidth of all downloads from HOST in kByte/s, may be given several times. HOST * applies to all other hosts (default: %(default)s)', action='append', default=None, metavar='HOST=KBYTE')
+    parser.add_argument("--priority", help='Download broadcasts of all shows in this order: newest first, or expiring (oldest) first, so broadcasts about to leave FM4\'s seven day archive get saved first. Default: show by show, newest first (default: %(default)s)', choices=PRIORITIES, default=None)
+    parser.add_argument("--watch", help='Keep running and download broadcasts as soon as they have ended (default: %(default)s)', default=False, action='store_true')
+    parser.add_argument("--watch-delay", help='Seconds to wait after a broadcast\'s end before downloading it in --watch mode (default: %(default)s)', type=int, default=WATCH_SETTINGS['delay'], metavar='SECONDS')
+    parser.add_argument("--watch-refresh", help='Seconds between searches for new broadcasts in --watch mode (default: %(default)s)', type=int, default=WATCH_SETTINGS['refresh'], metavar='SECONDS')
+    parser.add_argument("--metrics", help='Write time, requests, bytes and retries of each stage (search, download, cut, tags, ...) to FILE at the end of the run, in Prometheus text format if FILE ends with .prom, as JSON otherwise (default: %(default)s)', default=None, metavar='FILE')
+    parser.add_argument("--profile", help='Profile cutting and tagging with cProfile and save the statistics to FILE, for pstats or snakeviz. Cutting and tagging of parallel jobs then run one at a time (default: %(default)s)', default=None, metavar='FILE')
+    parser.add_argument("--verify", help='Check all files in DIR: size and checksum, MPEG frames and duration. Broken or missing files of broadcasts still available get downloaded again, files not in the archive index with --cut and --ignore (default: %(default)s)', default=None, metavar='DIR')
+    parser.add_argument("--config", help='Process all shows listed in this TOML or JSON file, instead of ShowTitle and TargetDirectory (default: %(default)s)', default=None, metavar='FILE')
+    parser.add_argument("ShowTitle", help='The show\'s title (e.g. "Morning Show")', nargs='?')
+    parser.add_argument("TargetDirectory", help='Directory to save the files in (default: %(default)s)', nargs='?', default=os.getcwd())
+
+    args = parser.parse_args()
+
+    # Fail early, not after the first download
+    if importlib.util.find_spec('mutagen') is None:
+        print("Python module \"mutagen\" is missing, see README.md", file=sys.stderr)
+        sys.exit(1)
+
+    JOBS = max(1, args.jobs)
+    SEGMENTS = max(1, args.segments)
+    HOST_SLOTS['max_per_host'] = max(1, args.max_per_host)
+    HTTP_SETTINGS['timeout'] = args.timeout
+    HTTP_SETTINGS['retries'] = max(0, args.retries)
+    HTTP_SETTINGS['compression'] = not args.no_compression
+    HTTP_SETTINGS['pool_size'] = max(HTTP_SETTINGS['pool_size'], JOBS * SEGMENTS)
+    CACHE_SETTINGS['enabled'] = not args.no_cache
+    CACHE_SETTINGS['directory'] = args.cache_dir
+    CACHE_SETTINGS['ttl'] = args.cache_ttl
+    CACHE_SETTINGS['max_size'] = args.cache_size*1024*1024
+    ARCHIVE_INDEX['filepath'] = args.index
+    STREAM_CUT['enabled'] = args.cut_while_downloading
+    BANDWIDTH['rate'] = args.rate_limit*1024 if args.rate_limit else None
+    for host_rate_limit in args.host_rate_limit or []:
+        host, separator, rate = host_rate_limit.rpartition('=')
+        if not separator or not host or not rate.isdigit() or int(rate) == 0:
+            parser.error(f"invalid --host-rate-limit {host_rate_limit}, expected HOST=KBYTE")
+        BANDWIDTH['host_rates'][host.lower()] = int(rate)*1024
+    WATCH_SETTINGS['delay'] = max(0, args.watch_delay)
+    WATCH_SETTINGS['refresh'] = max(60, args.watch_refresh)
+    METRICS['filepath'] = args.metrics
+    if args.profile:
+        import cProfile
+        METRICS['profile'] = cProfile.Profile()
+    IMAGE_SETTINGS['max_width'] = args.max_image_width
+    IMAGE_SETTINGS['budget'] = args.image_budget*1024 if args.image_budget is not None else None
+    IMAGE_SETTINGS['differing_only'] = args.differing_chapter_images
+
+    try:
+        return run(args, parser, JOBS, SEGMENTS)
+    finally:
+        if args.metrics:
+            write_metrics(args.metrics)
+        if args.profile:
+            METRICS['profile'].dump_stats(args.profile)
+
+
+def run(args, parser, num_jobs, num_segments):
+    """
+    Run what the command line arguments ask for: re-cut, watch, or download all broadcasts once
+    """
+
+    if args.recut:
+        # Re-cut kept originals, pure local I/O
+        if not os.path.isdir(args.recut):
+            print(f"Directory {args.recut} does not exist!", file=sys.stderr)
+            sys.exit(1)
+        HTTP_SETTINGS['offline'] = True
+        cut_chapter_types = [ x.strip().upper() for x in args.cut.split(',') ] if args.cut else []
+        jobs = get_recut_jobs(args.recut, cut_chapter_types, args.ignore, buffered=num_jobs > 1)
+        if num_jobs == 1:
+            for job in jobs:
+                try:
+                    finish_broadcast(job)
+                except Exception as e:
+                    print(f"ERROR: Failed to process {job['filepath']}: {e}", file=sys.stderr)
+        else:
+            run_recut_jobs(jobs, num_jobs)
+        return True
+
+    if args.verify:
+        # Check archive, and repair what can be repaired
+        if not os.path.isdir(args.verify):
+            print(f"Directory {args.verify} does not exist!", file=sys.stderr)
+            sys.exit(1)
+        cut_chapter_types = [ x.strip().upper() for x in args.cut.split(',') ] if args.cut else []
+        if verify_archive(args.verify, num_jobs, cut_chapter_types, args.ignore):
+            sys.exit(1)
+        return True
+
+    if args.config:
+        try:
+            shows = load_shows_config(args.config)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Could not read config file {args.config}: {e}", file=sys.stderr)
+            sys.exit(1)
+    elif args.ShowTitle:
+        shows = [{
+            'title': args.ShowTitle.strip(),
+            'directory': args.TargetDirectory,
+            'cut_chapter_types': [ x.strip().upper() for x in args.cut.split(',') ] if args.cut else [],
+            'ignore_keepmarks': args.ignore,
+            'only_newest': args.newest,
+            'keep_original': args.keep_original,
+        }]
+    else:
+        parser.error("either ShowTitle, --config, --recut or --verify is required")
+
+    for show in shows:
+        if not os.path.isdir(show['directory']):
+            print(f"Directory {show['directory']} does not exist!", file=sys.stderr)
+            sys.exit(1)
+
+    if args.watch:
+        watch(shows, num_jobs, segments=num_segments, priority=args.priority)
+        return True
+
+    # Process all matching broadcasts of all shows
+    search_results = search_shows([ show['title'] for show in shows ])
+    if args.priority:
+        jobs = get_prioritized_jobs(shows, search_results, args.priority, buffered=num_jobs > 1)
+    else:
+        jobs = itertools.chain.from_iterable(get_show_jobs(show, buffered=num_jobs > 1, search_results=search_results[show['title']]) for show in shows)
+    process_jobs(jobs, num_jobs, segments=num_segments)
 
     return True
 
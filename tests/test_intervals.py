@@ -0,0 +1,171 @@
+"""
+Randomized tests of the keepmark and chapter arithmetic in fm4-7tage-download.py
+subtract_intervals() is checked against a brute-force set difference,
+align_chapters_to_keepmarks() against its previous, linear-scan implementation.
+"""
+
+import os
+import random
+import importlib.util
+
+import pytest
+
+SCRIPT_FILEPATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fm4-7tage-download.py')
+
+spec = importlib.util.spec_from_file_location('fm4_7tage_download', SCRIPT_FILEPATH)
+fm4 = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(fm4)
+
+# Number of random inputs per property
+RUNS = 20000
+
+
+def random_keepmarks(rng, duration=200):
+    """
+    Sorted, non-overlapping [start, end] keepmarks, some of them adjacent
+    """
+
+    bounds = sorted(rng.sample(range(duration), 2 * rng.randint(0, 6)))
+    keepmarks = [ [bounds[num], bounds[num + 1]] for num in range(0, len(bounds), 2) ]
+    # Close some gaps, so that keepmarks touch each other
+    for num in range(1, len(keepmarks)):
+        if rng.random() < 0.2:
+            keepmarks[num][0] = keepmarks[num - 1][1]
+    rng.shuffle(keepmarks)
+    return keepmarks
+
+
+def random_chapters(rng, duration=200):
+    """
+    Chapters at random positions, overlapping each other and possibly empty
+    """
+
+    chapters = []
+    for num in range(rng.randint(0, 8)):
+        start = rng.randint(0, duration)
+        chapters.append({
+            'title': f'Chapter {num}',
+            'type': rng.choice('MNWJ'),
+            'offset_start': start,
+            'offset_end': min(duration, start + rng.randint(0, duration // 3)),
+        })
+    return chapters
+
+
+def covered(intervals):
+    """
+    Set of integer positions covered by half-open [start, end] intervals
+    """
+
+    return { position for start, end in intervals for position in range(start, end) }
+
+
+def previous_align_chapters_to_keepmarks(chapters, keepmarks):
+    """
+    align_chapters_to_keepmarks() as it was before the switch to binary search
+    """
+
+    chapters = sorted(chapters, key=lambda x: x['offset_start'])
+    keepmarks = sorted(keepmarks, key=lambda x: x[0])
+
+    broadcast_duration = sum(offset_end - offset_start for offset_start, offset_end in keepmarks)
+
+    gaps = []
+    gap = 0
+    previous_end = 0
+    for keepmark in keepmarks:
+        gap = gap + keepmark[0] - previous_end
+        previous_end = keepmark[1]
+        gaps.append(gap)
+
+    aligned_chapters = []
+
+    for chapter in chapters:
+        new_offset_start = None
+        new_offset_end = None
+        skip_chapter_flag = False
+        for keepmark_num, keepmark in enumerate(keepmarks):
+            if chapter['offset_end'] < keepmark[0]:
+                skip_chapter_flag = True
+                break
+            if chapter['offset_start'] <= keepmark[1]:
+                new_offset_start = max(chapter['offset_start'], keepmark[0]) - gaps[keepmark_num]
+                break
+
+        if skip_chapter_flag:
+            continue
+
+        for keepmark_num, keepmark in reversed(list(enumerate(keepmarks))):
+            if chapter['offset_start'] > keepmark[1]:
+                skip_chapter_flag = True
+                break
+            if chapter['offset_end'] >= keepmark[0]:
+                new_offset_end = min(chapter['offset_end'], keepmark[1]) - gaps[keepmark_num]
+                break
+
+        if skip_chapter_flag:
+            continue
+
+        if new_offset_start is not None and new_offset_end is not None and new_offset_start < new_offset_end:
+            aligned_chapter = chapter.copy()
+            aligned_chapter['offset_start'] = new_offset_start
+            aligned_chapter['offset_end'] = min(new_offset_end, broadcast_duration)
+            aligned_chapters.append(aligned_chapter)
+
+    return aligned_chapters
+
+
+@pytest.fixture
+def rng():
+    return random.Random(0)
+
+
+def test_merge_intervals(rng):
+    for _ in range(RUNS):
+        intervals = [ [start, start + rng.randint(0, 30)] for start in rng.choices(range(200), k=rng.randint(0, 8)) ]
+        merged = fm4.merge_intervals([ interval.copy() for interval in intervals ])
+
+        assert covered(merged) == covered(intervals)
+        # Sorted, and neither overlapping nor touching
+        assert all(merged[num][1] < merged[num + 1][0] for num in range(len(merged) - 1))
+
+
+def test_subtract_intervals(rng):
+    for _ in range(RUNS):
+        keepmarks = random_keepmarks(rng)
+        removals = [ [chapter['offset_start'], chapter['offset_end']] for chapter in random_chapters(rng) ]
+        result = fm4.subtract_intervals(keepmarks, removals)
+
+        assert covered(result) == covered(keepmarks) - covered(removals)
+        # Sorted, non-empty, not overlapping
+        assert all(start < end for start, end in result)
+        assert all(result[num][1] <= result[num + 1][0] for num in range(len(result) - 1))
+        # Every remaining interval is part of one keepmark, adjacent keepmarks stay apart
+        assert all(any(start <= result_start and result_end <= end for start, end in keepmarks) for result_start, result_end in result)
+
+
+def test_subtract_intervals_removal_past_keepmark_end():
+    # Unwanted chapter starts inside the first keepmark and ends inside the second
+    assert fm4.subtract_intervals([[0, 100], [200, 300]], [[50, 250]]) == [[0, 50], [250, 300]]
+    # ... or runs past the end of the last keepmark
+    assert fm4.subtract_intervals([[0, 100]], [[50, 150]]) == [[0, 50]]
+    # Removals covering keepmarks completely leave nothing, not empty or inverted keepmarks
+    assert fm4.subtract_intervals([[0, 100], [100, 200]], [[0, 100], [90, 200]]) == []
+
+
+def test_remove_chaptertypes_from_keepmarks(rng):
+    for _ in range(RUNS // 10):
+        keepmarks = random_keepmarks(rng)
+        chapters = random_chapters(rng)
+        unwanted = [ [chapter['offset_start'], chapter['offset_end']] for chapter in chapters if chapter['type'] in ('N', 'W') ]
+        result = fm4.remove_chaptertypes_from_keepmarks(keepmarks, chapters, ('N', 'W'))
+
+        assert covered(result) == covered(keepmarks) - covered(unwanted)
+
+
+def test_align_chapters_to_keepmarks(rng):
+    for _ in range(RUNS):
+        keepmarks = random_keepmarks(rng)
+        chapters = random_chapters(rng)
+
+        assert fm4.align_chapters_to_keepmarks(chapters, keepmarks) == previous_align_chapters_to_keepmarks(chapters, keepmarks)
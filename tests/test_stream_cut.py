@@ -0,0 +1,124 @@
+"""
+Randomized comparison of the two MP3 cutters in fm4-7tage-download.py
+cut_audio() indexes a complete file, stream_cut_feed() parses the stream chunk by chunk while it gets downloaded.
+Given the same audio and keepmarks, both must write identical files.
+"""
+
+import io
+import os
+import random
+import importlib.util
+
+import pytest
+
+SCRIPT_FILEPATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fm4-7tage-download.py')
+
+spec = importlib.util.spec_from_file_location('fm4_7tage_download', SCRIPT_FILEPATH)
+fm4 = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(fm4)
+
+# Number of random streams
+RUNS = 300
+
+# MPEG-1 Layer III, 44.1 kHz: bitrate index -> kBit/s
+BITRATES = { 5: 64, 9: 128, 11: 192 }
+
+
+def random_frame(rng, bitrate_index):
+    """
+    One MPEG-1 Layer III frame, joint stereo, with random padding and random content
+    """
+
+    padding = rng.randint(0, 1)
+    size = 144 * BITRATES[bitrate_index] * 1000 // 44100 + padding
+    header = bytes([ 0xFF, 0xFB, (bitrate_index << 4) | (padding << 1), 0x44 ])
+    return header + rng.randbytes(size - 4)
+
+
+def random_stream(rng):
+    """
+    MP3 stream with what downloads may contain: ID3v2 tag, garbage before the first frame and between frames,
+    changing bitrates, and an incomplete last frame
+    """
+
+    stream = bytearray()
+    if rng.random() < 0.3:
+        stream += b'ID3\x03\x00\x00\x00\x00\x00\x20' + bytes(0x20)
+    if rng.random() < 0.5:
+        # Garbage, possibly with something looking like a frame header
+        stream += rng.randbytes(rng.randint(1, 600))
+
+    vbr = rng.random() < 0.3
+    bitrate_index = 9
+    for num in range(rng.randint(1, 400)):
+        if vbr:
+            bitrate_index = rng.choice(list(BITRATES))
+        stream += random_frame(rng, bitrate_index)
+        if num == 0 and rng.random() < 0.3:
+            # Junk right after the first frame
+            stream += rng.randbytes(rng.randint(1, 50))
+        elif rng.random() < 0.01:
+            stream += rng.randbytes(rng.randint(1, 300))
+
+    if rng.random() < 0.3:
+        stream += random_frame(rng, bitrate_index)[:rng.randint(1, 200)]
+    return bytes(stream)
+
+
+def random_keepmarks(rng, duration=400 * 26.122):
+    bounds = sorted(rng.uniform(0, duration) for _ in range(2 * rng.randint(1, 4)))
+    return [ [bounds[num], bounds[num + 1]] for num in range(0, len(bounds), 2) ]
+
+
+def stream_cut(stream, keepmarks, rng):
+    """
+    Cut stream with stream_cut_feed(), fed in random chunks
+    """
+
+    output_file = io.BytesIO()
+    state = fm4.new_stream_cut(keepmarks)
+    pos = 0
+    while pos < len(stream):
+        size = rng.randint(1, 5000)
+        fm4.stream_cut_feed(state, stream[pos:pos+size], output_file)
+        pos += size
+    fm4.stream_cut_finish(state, output_file)
+    return output_file.getvalue()
+
+
+def file_cut(stream, keepmarks, tmp_path):
+    """
+    Cut stream with cut_audio()
+    """
+
+    input_filepath = tmp_path / 'input.mp3'
+    output_filepath = tmp_path / 'output.mp3'
+    input_filepath.write_bytes(stream)
+    fm4.cut_audio(str(input_filepath), str(output_filepath), keepmarks)
+    return output_filepath.read_bytes()
+
+
+def test_stream_cut_matches_cut_audio(tmp_path):
+    rng = random.Random(0)
+    for _ in range(RUNS):
+        stream = random_stream(rng)
+        keepmarks = random_keepmarks(rng)
+
+        try:
+            expected = file_cut(stream, keepmarks, tmp_path)
+        except ValueError:
+            # Nothing left after cutting, stream cut must fail as well
+            with pytest.raises(ValueError):
+                stream_cut(stream, keepmarks, rng)
+            continue
+
+        assert stream_cut(stream, keepmarks, rng) == expected
+
+
+def test_first_frame_followed_by_junk(tmp_path):
+    # First frame is followed by junk, so it's no more trustworthy than any other frame sync in garbage
+    rng = random.Random(1)
+    stream = random_frame(rng, 9) + b'\x00' * 20 + b''.join(random_frame(rng, 9) for _ in range(50))
+    keepmarks = [[0, 500]]
+
+    assert stream_cut(stream, keepmarks, rng) == file_cut(stream, keepmarks, tmp_path)